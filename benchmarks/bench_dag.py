@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Benchmarks for building and writing DAGs, and for starting jobs.
+
+    python benchmarks/bench_dag.py                       # default cases
+    python benchmarks/bench_dag.py --output results.json # save the results
+    python benchmarks/bench_dag.py --sizes 1000,1000000 --shapes flat,chain
+    python benchmarks/bench_dag.py --output new.json --baseline old.json
+
+Each case (shape x size) is run in a fresh python process in a scratch
+directory, so that its peak RSS is its own. For each case we record:
+
+  build   - wall time and peak RSS after all the defer() calls
+  write   - wall time and peak RSS after Dag.write()
+  bytes   - bytes written, by file type (dag, in, sub, shared)
+  startup - wall time of the first few jobs run as htcondor would run
+            them (a new interpreter reading its input file on stdin)
+  run     - time of the same jobs within this process (run() only)
+
+A summary of each case is printed on stderr; with --output, the full
+results are also written there as JSON. With --baseline, times and RSS
+which have grown by more than --tolerance (a fraction) compared with an
+earlier --output are reported, and the exit status is 1.
+
+Shapes:
+  flat     - independent jobs (fan-out)
+  chain    - each job takes the value of the previous one
+  diamond  - a chain of diamonds: a -> (b, c) -> d -> ...
+  cluster  - jobs with processes=10 and procid, each also taking the
+             values of the previous cluster
+"""
+from __future__ import print_function
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from htcondor_dag import Dag, autorun, procid, run_local_process
+
+SHAPES = ["flat", "chain", "diamond", "cluster"]
+
+def work(*args):
+    return len(args)
+
+autorun(report_hostname=False)
+
+def peak_rss():
+    """Peak RSS of this process so far, in kB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def build(dag, shape, size, keep):
+    """
+    Add about size nodes of the given shape to dag. Returns the first keep
+    jobs, as (id, input filename, output filename, procid).
+    """
+    d_work = dag.defer(work)
+    d_cluster = dag.defer(work, processes=10)
+    first = []
+    def kept(job, procids=(0,)):
+        if len(first) < keep:
+            first.extend([(job.id, str(job['input']), job['output'], p)
+                          for p in procids])
+        return job
+    if shape == "flat":
+        for i in range(size):
+            kept(d_work(i))
+    elif shape == "chain":
+        job = kept(d_work(0))
+        for i in range(1, size):
+            job = kept(d_work(job))
+    elif shape == "diamond":
+        top = kept(d_work(0))
+        for i in range(size // 4):
+            b = kept(d_work(top, 1))
+            c = kept(d_work(top, 2))
+            top = kept(d_work(b, c))
+    elif shape == "cluster":
+        job = kept(d_cluster(procid), range(10))
+        for i in range(1, size // 10):
+            job = kept(d_cluster(procid, job), range(10))
+    else:
+        raise ValueError("Unknown shape %s" % shape)
+    return first[:keep]
+
+def file_bytes(directory):
+    """Return {file type: total bytes} for the files in a directory"""
+    sizes = {}
+    for fn in os.listdir(directory):
+        kind = fn.rsplit(".", 1)[-1]
+        if kind in ("out", "err") or fn.startswith("job."):
+            continue
+        sizes[kind] = sizes.get(kind, 0) + os.path.getsize(os.path.join(directory, fn))
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+def summary(times):
+    if not times:
+        return {"samples": 0}
+    return {"samples": len(times), "mean_s": sum(times) / len(times),
+            "min_s": min(times), "max_s": max(times)}
+
+def run_case(shape, size, stream, startup):
+    """Run one case in the current directory, returning its results"""
+    result = {"shape": shape, "size": size, "stream": stream}
+    start = time.time()
+    dag = Dag("bench", stream=stream)
+    first = build(dag, shape, size, startup)
+    result["build"] = {"seconds": time.time() - start, "peak_rss_kb": peak_rss()}
+    result["nodes"] = dag.flushed + len(dag.nodes)
+
+    start = time.time()
+    dag.write()
+    result["write"] = {"seconds": time.time() - start, "peak_rss_kb": peak_rss()}
+    result["bytes"] = file_bytes(".")
+
+    # Jobs are run in dag order, so the values they need are already there
+    script = os.path.abspath(__file__)
+    startup_times = []
+    for (id, input, output, p) in first:
+        with open("job.ad", "w") as ad:
+            print('DAGNodeName = "%s"\nProcId = %d' % (id, p), file=ad)
+        env = dict(os.environ, _CONDOR_JOB_AD="job.ad")
+        start = time.time()
+        with open(input, "rb") as src:
+            with open(output.replace("$(process)", str(p)), "wb") as dst:
+                subprocess.check_call([sys.executable, script], stdin=src,
+                                      stdout=dst, env=env)
+        startup_times.append(time.time() - start)
+    result["startup"] = summary(startup_times)
+    run_times = []
+    for (id, input, output, p) in first:
+        (_, _, seconds, error) = run_local_process(
+            id, input, output.replace("$(process)", str(p)), p, {})
+        if error:
+            raise RuntimeError(error)
+        run_times.append(seconds)
+    result["run"] = summary(run_times)
+    return result
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against the baseline results"""
+    old = dict([((r["shape"], r["size"], r["stream"]), r)
+                for r in baseline["results"]])
+    regressions = []
+    for r in results:
+        b = old.get((r["shape"], r["size"], r["stream"]))
+        if b is None:
+            continue
+        for (phase, key) in [("build", "seconds"), ("build", "peak_rss_kb"),
+                             ("write", "seconds"), ("write", "peak_rss_kb"),
+                             ("startup", "mean_s"), ("run", "mean_s")]:
+            (new, was) = (r[phase].get(key), b.get(phase, {}).get(key))
+            if new is not None and was and new > was * (1 + tolerance):
+                regressions.append("%s/%d%s %s %s: %.4g -> %.4g" % (
+                    r["shape"], r["size"], " stream" if r["stream"] else "",
+                    phase, key, was, new))
+    return regressions
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shapes", default=",".join(SHAPES))
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--stream", action="store_true",
+                        help="also run each case with a streaming Dag")
+    parser.add_argument("--startup", type=int, default=5,
+                        help="number of jobs to start (default 5)")
+    parser.add_argument("--output", help="file to write the results to (JSON)")
+    parser.add_argument("--baseline", help="earlier results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.case:
+        (shape, size, stream) = opts.case.split(":")
+        result = run_case(shape, int(size), stream == "1", opts.startup)
+        json.dump(result, sys.stdout)
+        return 0
+
+    results = []
+    for shape in opts.shapes.split(","):
+        for size in [int(s) for s in opts.sizes.split(",")]:
+            for stream in ([False, True] if opts.stream else [False]):
+                workdir = tempfile.mkdtemp(prefix="bench_dag.")
+                try:
+                    out = subprocess.check_output(
+                        [sys.executable, os.path.abspath(__file__),
+                         "--case", "%s:%d:%d" % (shape, size, stream),
+                         "--startup", str(opts.startup)], cwd=workdir)
+                finally:
+                    shutil.rmtree(workdir)
+                r = json.loads(out.decode("utf-8"))
+                results.append(r)
+                print("%-8s %8d%s  build %7.3fs  write %7.3fs  rss %8dkB  "
+                      "%10d bytes  startup %.3fs" % (
+                          shape, size, " stream" if stream else "       ",
+                          r["build"]["seconds"], r["write"]["seconds"],
+                          r["write"]["peak_rss_kb"], r["bytes"]["total"],
+                          r["startup"].get("mean_s", 0)), file=sys.stderr)
+
+    report = {"python": platform.python_version(),
+              "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "results": results}
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            regressions = compare(results, json.load(f), opts.tolerance)
+        for line in regressions:
+            print("REGRESSION: %s" % line, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
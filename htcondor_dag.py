@@ -19,13 +19,149 @@ from __future__ import print_function, absolute_import
 import sys
 import os
 import re
+import struct
+import time
+import types
+import operator
+from array import array
+from collections import OrderedDict
 try:
     import cPickle as pickle
 except:
     import pickle
+try:
+    intern
+except NameError:
+    from sys import intern
 
 pickle_protocol = pickle.HIGHEST_PROTOCOL
 
+# Input files start with this magic, and end with the offset of the index
+INPUT_MAGIC = b'HTCDAGI1'
+# An input file's index: (name offset, name length, record offset, record
+# length) for each job, sorted by name; then the index offset and count
+INPUT_ENTRY = struct.Struct('>QIQQ')
+INPUT_TRAILER = struct.Struct('>QQ')
+
+# Compression codecs for input and output files: name => magic bytes.
+# When reading, the codec is detected from the magic, so files written
+# with different (or no) compression can be mixed freely.
+CODECS = [
+    ('zlib', (b'\x78\x01', b'\x78\x5e', b'\x78\x9c', b'\x78\xda')),
+    ('gzip', (b'\x1f\x8b',)),
+    ('bz2',  (b'BZh',)),
+    ('lzma', (b'\xfd7zXZ\x00',)),
+]
+
+def compress(data, codec=None):
+    """Compress a string of pickled data with the named codec, or not at all"""
+    if codec is None:
+        return data
+    elif codec == 'zlib':
+        import zlib
+        return zlib.compress(data)
+    elif codec == 'gzip':
+        import gzip, io
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+            f.write(data)
+        return buf.getvalue()
+    elif codec == 'bz2':
+        import bz2
+        return bz2.compress(data)
+    elif codec == 'lzma':
+        import lzma
+        return lzma.compress(data)
+    raise ValueError("Unknown compression codec '%s'" % codec)
+
+def codec_of(data):
+    """Return the name of the codec which compressed data, or None"""
+    for (codec, magics) in CODECS:
+        if data.startswith(magics):
+            return codec
+    return None
+
+def decompress(data):
+    """Undo compress(), detecting the codec from the magic bytes"""
+    codec = codec_of(data)
+    if codec is None:
+        return data
+    elif codec == 'zlib':
+        import zlib
+        return zlib.decompress(data)
+    elif codec == 'gzip':
+        import gzip, io
+        with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as f:
+            return f.read()
+    elif codec == 'bz2':
+        import bz2
+        return bz2.decompress(data)
+    elif codec == 'lzma':
+        import lzma
+        return lzma.decompress(data)
+
+def load_value(src, buffers=None):
+    """
+    Unpickle a value from a file, which may be compressed. buffers names
+    the sidecar file holding any arrays written out-of-band by
+    dumps_buffers().
+    """
+    head = src.read(6)
+    if codec_of(head) is None:
+        src.seek(0)
+        if buffers is None:
+            return pickle.load(src)
+        unpickler = pickle.Unpickler(src)
+    elif buffers is None:
+        return pickle.loads(decompress(head + src.read()))
+    else:
+        import io
+        unpickler = pickle.Unpickler(io.BytesIO(decompress(head + src.read())))
+    unpickler.persistent_load = lambda pid: load_buffer(buffers, pid)
+    return unpickler.load()
+
+# Default minimum size of arrays written out-of-band (see dumps_buffers),
+# and their alignment within the sidecar file
+BUFFER_MIN_BYTES = 1 << 20
+BUFFER_ALIGN = 64
+
+def dumps_buffers(value, sidecar, min_bytes=BUFFER_MIN_BYTES):
+    """
+    Pickle a value, but write the data of any numpy arrays of at least
+    min_bytes raw to the file sidecar instead of into the pickle. The
+    sidecar is always created, even if it is empty.
+    """
+    import io
+    numpy = sys.modules.get('numpy')   # (no arrays if it was never imported)
+    with open(sidecar, 'wb') as buf:
+        def persistent_id(obj):
+            if (numpy is not None and isinstance(obj, numpy.ndarray) and
+                obj.nbytes >= min_bytes and not obj.dtype.hasobject):
+                offset = -buf.tell() % BUFFER_ALIGN + buf.tell()
+                buf.seek(offset)
+                numpy.ascontiguousarray(obj).tofile(buf)
+                return ('ndarray', offset, obj.dtype, obj.shape)
+            return None
+        out = io.BytesIO()
+        p = pickle.Pickler(out, pickle_protocol)
+        p.persistent_id = persistent_id
+        p.dump(value)
+    return out.getvalue()
+
+def load_buffer(sidecar, pid):
+    """
+    Return an array written by dumps_buffers(), as a read-only memory map
+    of the sidecar file, so that nothing is copied and jobs on the same
+    machine share the page cache
+    """
+    import numpy
+    (kind, offset, dtype, shape) = pid
+    if kind != 'ndarray':
+        raise pickle.UnpicklingError("Unknown buffer %r" % (pid,))
+    if not all(shape):
+        return numpy.empty(shape, dtype)
+    return numpy.memmap(sidecar, dtype=dtype, mode='r', offset=offset, shape=shape)
+
 def pypath(src):
     return re.sub(r'\.pyc$', '.py', os.path.abspath(src))
 
@@ -36,6 +172,29 @@ DEFAULT_SUBMIT_VARS = {
     'executable': pypath(sys.argv[0]),
 }
 
+def worker_submit_vars():
+    """
+    Return the submit file variables for a Dag(worker=True): the jobs run
+    htcondor_dag.py itself (see worker_main), passing it the generator
+    script and the options given to autorun()
+    """
+    script = pypath(sys.argv[0])
+    args = [os.path.basename(script)]
+    if autorun_options.get('compression'):
+        args.append('--compression=%s' % autorun_options['compression'])
+    if autorun_options.get('stats') is True:
+        args.append('--stats')
+    elif autorun_options.get('stats'):
+        args.append('--stats=%s' % autorun_options['stats'])
+    if autorun_options.get('output_none'):
+        args.append('--output-none')
+    if autorun_options.get('tune'):
+        args.append('--tune')
+    if autorun_options.get('report_hostname') is False:
+        args.append('--quiet')
+    return dict(DEFAULT_SUBMIT_VARS, executable=pypath(__file__), arguments=args,
+                transfer_input_files='%s,%s,$(input_files)' % (pypath(__file__), script))
+
 ############################################################
 #
 # Tools for writing a DAG file of queued function calls
@@ -44,12 +203,28 @@ DEFAULT_SUBMIT_VARS = {
 
 class Input(object):
     """
-    An object which stores input arguments for one or more deferred calls
+    An object which stores input arguments for one or more deferred calls.
+
+    The file is written as INPUT_MAGIC, then one pickled record per job,
+    then the job names and a fixed-width index of INPUT_ENTRY sorted by
+    name, and finally INPUT_TRAILER. At runtime each job binary searches
+    the index and unpickles only its own arguments, so its cost barely
+    grows with the number of jobs sharing the input file; and records can
+    be appended one at a time by a streaming Dag.
     """
-    def __init__(self, filename):
+    __slots__ = ('filename', 'compression', 'data', 'nbytes', 'written',
+                 'file', 'index', 'pos', 'pickled')
+
+    def __init__(self, filename, compression=None):
         self.filename = filename
-        self.data = {}           # {"jobname":(func,args,kwargs)}
+        self.compression = compression
+        self.data = {}           # {"jobname":(func,args,kwargs), or None if pickled}
+        self.nbytes = 0          # pickled size of data (only if measured)
+        self.pickled = {}        # {"jobname":pickle} of measured records
         self.written = False
+        self.file = None         # open while records are being appended
+        self.index = {}          # {"jobname":(offset,len)} of written records
+        self.pos = 0
 
     def __repr__(self):
         return "Input(filename=%s,data=%s)" % (repr(self.filename),repr(self.data))
@@ -62,14 +237,104 @@ class Input(object):
 
     def write(self):
         if self.data and not self.written:
+            for k in sorted(self.data.keys()):
+                self.write_record(k, self.data[k])
+            self.close()
+
+    def set_record(self, key, value, measure=False):
+        """
+        Store the record for one job. If measure is true (or the job's
+        record was measured before), it is pickled now to count its size
+        in nbytes, and only that pickle is kept, to be written as it is.
+        """
+        if measure or key in self.pickled:
+            rec = pickle.dumps(value, pickle_protocol)
+            self.nbytes += len(rec) - len(self.pickled.get(key, b''))
+            self.pickled[key] = rec
+            value = None
+        self.data[key] = value
+
+    def record(self, key):
+        """Return the record stored for one job"""
+        if key in self.pickled:
+            return pickle.loads(self.pickled[key])
+        return self.data[key]
+
+    def write_record(self, key, value):
+        """Append the record for one job to the file"""
+        if self.written:
+            raise ValueError("Input file %s has already been written" % self)
+        if self.file is None:
+            self.file = open(self.filename, "wb")
+            self.file.write(INPUT_MAGIC)
+            self.pos = len(INPUT_MAGIC)
+        rec = self.pickled.pop(key, None)
+        if rec is None:
+            rec = pickle.dumps(value, pickle_protocol)
+        rec = compress(rec, self.compression)
+        self.index[key] = (self.pos, len(rec))
+        self.file.write(rec)
+        self.pos += len(rec)
+
+    def append(self, key):
+        """Append the record for one job to the file, and forget it"""
+        self.write_record(key, self.data.pop(key))
+
+    def close(self):
+        """Finish the file by writing the index"""
+        if self.file is not None:
+            records = sorted([(k.encode('utf-8') if isinstance(k, unicode) else k, v)
+                              for (k, v) in self.index.iteritems()])
+            self.file.write(b''.join([k for (k, v) in records]))
+            entries = []
+            pos = self.pos
+            for (k, (offset, length)) in records:
+                entries.append(INPUT_ENTRY.pack(pos, len(k), offset, length))
+                pos += len(k)
+            self.file.write(b''.join(entries))
+            self.file.write(INPUT_TRAILER.pack(pos, len(records)))
+            self.file.close()
+            self.file = None
+            self.index = {}
+        self.written = True
+
+class Shared(object):
+    """
+    A large argument value which is pickled once into its own file, and
+    shared by every job which is passed it. At unpickle time it is replaced
+    by the value, which is read only once per process.
+    """
+    __slots__ = ('filename', 'data', 'written')
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = data         # pickled (and possibly compressed) value
+        self.written = False
+
+    def __repr__(self):
+        return "Shared(filename=%s)" % repr(self.filename)
+
+    def __str__(self):
+        return self.filename
+
+    def __unicode__(self):
+        return self.filename
+
+    def write(self):
+        if not self.written:
             self.written = True
             with open(self.filename, "wb") as f:
-                pickle.dump(self.data, f, pickle_protocol)  # TODO: gzip
+                f.write(self.data)
+            self.data = None
+
+    def __reduce__(self):
+        return (read_shared, (self.filename,))
 
 class Submit(object):
     """
     An object which writes out a submit file
     """
+    __slots__ = ('filename', 'vars', 'written')
 
     def __init__(self, filename, **vars):
         self.filename = filename
@@ -114,13 +379,39 @@ class Submit(object):
 class Node(object):
     """
     Parent class for nodes within a DAG (jobs and sub-DAGs)
+
+    To keep large DAGs small in memory, a node's id is stored as an
+    interned prefix plus a sequence number, and dependencies between nodes
+    of the same Dag are held in arrays owned by the Dag. Dependencies with
+    nodes outside the Dag are kept on the node itself.
     """
+    __slots__ = ('prefix', 'seq', 'comment', 'dir', 'owner', 'index',
+                 'sealed', 'links')
+
     def __init__(self, id, comment=None, dir=None):
         self.id = id
         self.comment = comment
         self.dir = dir
-        self.parents = set()
-        self.children = set()
+        self.owner = None        # the Dag containing this node
+        self.index = None        # position within the owner
+        self.sealed = False      # written out by a streaming Dag
+        self.links = None        # (parents, children) outside the owner
+
+    def _get_id(self):
+        if self.seq is None:
+            return self.prefix
+        return "%s%d" % (self.prefix, self.seq)
+
+    def _set_id(self, id):
+        """id is either a string, or a tuple of (prefix, sequence number)"""
+        if isinstance(id, tuple):
+            self.prefix = intern(str(id[0]))
+            self.seq = id[1]
+        else:
+            self.prefix = id
+            self.seq = None
+
+    id = property(_get_id, _set_id)
 
     def __repr__(self):
         return "%s(%s)" % (self.__class__.__name__, repr(self.id))
@@ -132,25 +423,45 @@ class Node(object):
         return self.id
 
     def parent(self, *other):
-        self.parents.update(other)
+        for o in other:
+            depend(o, self)
         return self
 
     def child(self, *other):
-        self.children.update(other)
+        for o in other:
+            depend(self, o)
         return self
 
+    @property
+    def parents(self):
+        res = set(self.links[0]) if self.links else set()
+        if self.owner is not None:
+            res.update(self.owner.related(self.owner.parent_lists[self.index]))
+        return res
+
+    @property
+    def children(self):
+        res = set(self.links[1]) if self.links else set()
+        if self.owner is not None:
+            res.update(self.owner.related(self.owner.child_lists[self.index]))
+        return res
+
     def write_dag_header(self, file):
         print("", file=file)
         if self.comment:
             print(re.sub(r'^', '# ', self.comment, flags=re.MULTILINE), file=file)
 
-    def write_dag_footer(self, file):
-        if self.parents:
-            print("PARENT %s CHILD %s" %
-                  (" ".join(sorted([str(o) for o in self.parents])), self), file=file)
-        if self.children:
-            print("PARENT %s CHILD %s" %
-                  (self, " ".join(sorted([str(o) for o in self.children]))), file=file)
+
+def depend(parent, child):
+    """Record that child depends on parent"""
+    owner = child.owner
+    if owner is not None and parent.owner is owner:
+        owner.add_edge(parent.index, child.index)
+    else:
+        for (node, i, other) in ((child, 0, parent), (parent, 1, child)):
+            if node.links is None:
+                node.links = (set(), set())
+            node.links[i].add(other)
 
 class Job(Node):
     """
@@ -167,11 +478,21 @@ class Job(Node):
         "category":	"CATEGORY",
     }
 
-    def __init__(self, id, submit=None, comment=None, dir=None, noop=False, **vars):
+    # vars which are passed to the function's invocation in the input
+    # record, rather than as VARS
+    RUNTIME_OPTIONS = set(["profile", "buffers", "output_none"])
+
+    __slots__ = ('submit', 'noop', 'done', 'vars', 'func', 'cache_key')
+
+    def __init__(self, id, submit=None, comment=None, dir=None, noop=False,
+                 done=False, **vars):
         super(Job, self).__init__(id=id, comment=comment, dir=dir)
-        self.submit = submit or id+".sub"
+        self.submit = submit or self.id+".sub"
         self.noop = noop
+        self.done = done
         self.vars = vars
+        self.func = None
+        self.cache_key = None
 
     def write(self):
         """
@@ -192,15 +513,69 @@ class Job(Node):
             line += " DIR %s" % self.dir
         if self.noop:
             line += " NOOP"
+        if self.done:
+            line += " DONE"
         print(line, file=file)
         self.write_vars(file=file)
-        self.write_dag_footer(file)
 
     def var(self, **v):
         """Update one or more DAG variables"""
+        if self.sealed:
+            raise ValueError("Job %s has already been written" % self)
         self.vars.update(v)
+        if self.func is not None and (Job.RUNTIME_OPTIONS.intersection(v) or
+                                      'output' in v or 'processes' in v):
+            inp = self.vars['input']
+            inp.set_record(str(self), inp.record(str(self))[:3] + self.runtime_options())
         return self
 
+    def runtime_options(self):
+        """
+        Return the runtime options (see RUNTIME_OPTIONS) to be stored after
+        (func, args, kwargs) in the input record: an empty tuple if there
+        are none, otherwise a tuple holding a dict
+        """
+        options = dict([(k, v) for (k, v) in self.vars.items()
+                        if k in Job.RUNTIME_OPTIONS and v is not None])
+        if options.get('profile', 'cpu') not in PROFILE_MODES:
+            raise ValueError("Job %s: profile must be one of %s" % (
+                self, ", ".join(PROFILE_MODES)))
+        if 'buffers' in options:
+            # (minimum array size, sidecar filename)
+            sidecars = self.buffer_files()
+            if sidecars:
+                min_bytes = options['buffers']
+                if min_bytes is True:
+                    min_bytes = BUFFER_MIN_BYTES
+                options['buffers'] = (min_bytes, self['output'] + '.buf')
+            else:
+                del options['buffers']
+        return (options,) if options else ()
+
+    def buffer_files(self):
+        """
+        Return the sidecar files holding the large arrays in this job's
+        output(s), if it was deferred with buffers=True (or a minimum size)
+        """
+        if not self.vars.get('buffers') or self.vars.get('output') is None:
+            return []
+        return output_files(self.id, self['output'] + '.buf',
+                            self.vars.get('processes'))
+
+    def sidecar_remaps(self):
+        """
+        run() writes a sidecar in the job's scratch directory when the
+        directory it belongs in (e.g. a cache_dir) is not there. Return the
+        transfer_output_remaps entry which puts it back where the jobs
+        reading it expect it, or None if it is not needed.
+        """
+        if not self.buffer_files():
+            return None
+        sidecar = self['output'] + '.buf'
+        if not os.path.dirname(sidecar):
+            return None
+        return "%s=%s" % (os.path.basename(sidecar), sidecar)
+
     def processes(self, n):
         """Mark a job as running a cluster of multiple processes"""
         self.var(processes=n)
@@ -226,9 +601,17 @@ class Job(Node):
             myjob.var(foo="bar", bar="qux")
         """
         res = ''
-        for k in sorted(self.vars.keys()):
-            v = self[k]
-            if v is None:
+        remaps = self.sidecar_remaps()
+        keys = set(self.vars)
+        if remaps:
+            keys.add('transfer_output_remaps')
+        for k in sorted(keys):
+            if k == 'transfer_output_remaps' and remaps:
+                v = [str(self.vars.get(k) or '').strip('"'), remaps]
+                v = '"%s"' % ";".join([r for r in v if r])
+            else:
+                v = self[k]
+            if v is None or k in Job.RUNTIME_OPTIONS:
                 continue
             elif k in Job.OPTIONS:
                 if isinstance(v, list):
@@ -261,18 +644,37 @@ class Job(Node):
 
     def set_function_data(self, func, args, kwargs, dag):
         # Does this job have any other Jobs in its args or kwargs?
-        input_files = []
+        job_files = []
+        jobs = []
         for j in list(args) + kwargs.values():
-            if isinstance(j, Job):
-                self.parent(j)
-                input_files.extend(output_files(j.id, j['output'], j.vars.get('processes')))
+            if isinstance(j, Lazy):
+                j = j.job
+            if isinstance(j, JobGroup):
+                jobs.extend(j)
+            elif isinstance(j, Job):
+                jobs.append(j)
+        for j in jobs:
+            self.parent(j)
+            job_files.extend(output_files(j.id, j['output'], j.vars.get('processes')))
+            job_files.extend(j.buffer_files())
+        # Large argument values can be moved out into shared files
+        input_files = list(job_files)
+        if dag.share_bytes:
+            args = tuple([dag.share(a) for a in args])
+            kwargs = dict([(k, dag.share(v)) for (k,v) in kwargs.iteritems()])
+            input_files.extend(set([str(v) for v in list(args) + kwargs.values()
+                                    if isinstance(v, Shared)]))
         if input_files:
             self.var(input_files=",".join(sorted(input_files)))
         # We also need a separate input file for this job
-        if input_files or 'input' not in self.vars or not hasattr(self.vars['input'],'data'):
-            self.vars['input'] = Input(filename="%s.%s.in" % (dag.id, self))
+        if job_files or 'input' not in self.vars or not hasattr(self.vars['input'],'data'):
+            self.vars['input'] = Input(filename="%s.%s.in" % (dag.id, self),
+                                       compression=dag.compression)
         # Finally store the function and args
-        self.vars['input'].data[str(self)] = (func, args, kwargs)
+        self.func = func
+        inp = self.vars['input']
+        inp.set_record(str(self), (func, args, kwargs) + self.runtime_options(),
+                       measure=dag.shard_bytes and inp is dag.input)
         return self
 
     def __reduce__(self):
@@ -283,54 +685,813 @@ class Job(Node):
         return (read_job_output,
                 (self.id, self['output'], self.vars.get('processes')))
 
+class Lazy(object):
+    """
+    A Job passed as an argument to another job, whose value is to be read
+    lazily at runtime (see lazy())
+    """
+    __slots__ = ('job',)
+
+    def __init__(self, job):
+        self.job = job
+
+    def __reduce__(self):
+        job = self.job
+        return (read_job_output,
+                (job.id, job['output'], job.vars.get('processes'), True))
+
+class JobGroup(list):
+    """
+    A list of the jobs created by Dag.map(). Passed as an argument to
+    another job, it becomes a single flat list of all their results.
+    """
+    def __reduce__(self):
+        return (read_group_output,
+                ([(j.id, j['output'], j.vars.get('processes')) for j in self],))
+
+def lazy(job):
+    """
+    Wrap a job argument so that its value is read lazily: it arrives as a
+    LazyValue, which reads the job's output the first time it is used; or
+    for a cluster as an OutputSequence, which unpickles each process's
+    output only when it is accessed.
+
+        dag.defer(total)(lazy(cluster_job))
+    """
+    if not isinstance(job, Job):
+        raise TypeError("lazy() needs a Job, not %r" % (job,))
+    return Lazy(job)
+
+# Number of recently shared values which Dag.share() remembers by identity
+SHARE_RECENT = 16
+
 class Dag(Node):
     """
     A Dag is a collection of nodes (jobs or sub-dags). It also allocates
     node ids.
+
+    If shard_jobs or shard_bytes is set, the shared input file is split
+    into shards (id.0.in, id.1.in, ...) and a new shard is started once
+    the current one holds shard_jobs records or shard_bytes of pickled
+    data. Each job then only transfers the shard containing its arguments.
+    With shard_bytes, each record is pickled once, when the call is
+    deferred, and only the pickle is kept; so later changes to its
+    arguments are not written out.
+
+    compression names a codec (see CODECS) for the input files it creates.
+
+    If share_bytes is set, any argument of a deferred call whose pickle is
+    at least that many bytes is written once to its own file (named after
+    a hash of its contents) and jobs refer to it, rather than each job's
+    input record carrying its own copy. Such arguments are pickled when
+    the call is deferred, so changes made to them afterwards are not seen
+    by the jobs.
+
+    If stream is true, each node is written out (to the DAG file and its
+    input file) as soon as the next node is created, and is then dropped
+    from the Dag. After that its vars can no longer be changed, but
+    dependencies can still be added; they are kept as a compact table of
+    node numbers and written at the end.
+
+    If cache_dir is set, each deferred call (with the default output file)
+    gets a key which is a hash of the function's code, its arguments, and
+    the keys of any jobs passed as arguments. The job's output is written
+    to cache_dir/<key>.out (even if it is None), and linked from its usual
+    output filename. If a valid output already exists there when the DAG
+    is written, and all the job's parents are DONE, the job is marked DONE
+    and its arguments are not written out - so only the jobs affected by a
+    change are rerun.
+
+    resume_from names a rescue DAG or node status file from an earlier run
+    of this DAG (see write()); a streaming Dag must be given it here.
+
+    If worker is true, the default submit file runs htcondor_dag.py as the
+    executable instead of the generator script (see worker_main), so jobs
+    do not pay for the script's imports.
     """
     def __init__(self, id, filename=None, comment=None, dir=None, maxjobs=None,
-                 submit=None, input=None, config={}):
+                 submit=None, input=None, config={},
+                 shard_jobs=None, shard_bytes=None, compression=None,
+                 share_bytes=None, stream=False, cache_dir=None,
+                 resume_from=None, worker=False):
         super(Dag, self).__init__(id=id, comment=comment, dir=dir)
         self.filename = filename or (id + '.dag')
         self.maxjobs = maxjobs or {} # category => limit
-        self.submit = submit or Submit(filename=id+".sub", **DEFAULT_SUBMIT_VARS)
-        self.input = input or Input(filename=id+".in")
+        self.submit = submit or Submit(filename=id+".sub", **(
+            worker_submit_vars() if worker else DEFAULT_SUBMIT_VARS))
+        self.shard_jobs = shard_jobs
+        self.shard_bytes = shard_bytes
+        self.shards = 0
+        self.compression = compression
+        self.share_bytes = share_bytes
+        self.shared = {}             # digest => Shared
+        self.shared_ids = OrderedDict() # id(value) => (value, Shared), recent
+        if shard_jobs or shard_bytes:
+            self.input = input or Input(filename="%s.0.in" % id,
+                                        compression=compression)
+        else:
+            self.input = input or Input(filename=id+".in",
+                                        compression=compression)
         self.config = config
         self.nodes = []              # (list, not set: must preserve order)
         self.last_id = {}            # id_prefix => sequence number
         self.written = False
+        self.stream = stream
+        self.dag_file = None         # open while streaming
+        self.flushed = 0             # number of nodes written by streaming
+        self.extra_edges = set()     # (parent id, child id) outside the dag
+        self.kept_inputs = []        # Inputs supplied by the caller
+        self.removed_edges = 0       # by write(reduce_edges=True)
+        self.cache_dir = cache_dir
+        self.done = bytearray()      # node index => 1 if DONE
+        self.completed = completed_nodes(resume_from)
+        self.resource_hints = {}     # function => {var: value}
+        self.resource_usage = {}     # function => function_usage() record
+        self.run_times = {}          # function => seconds
+        self.tuned = {}              # function => {var: number of jobs given it}
+        self.explicit_priorities = set() # indexes of flushed jobs with a priority
+        # Compact table of node ids, by node index
+        self.prefixes = []           # prefix number => prefix
+        self.prefix_numbers = {}     # prefix => prefix number
+        self.id_prefixes = array('l')
+        self.id_seqs = array('l')    # sequence number, or -1 for a plain id
+        # Dependencies, by node index: array of node indexes, or None
+        self.parent_lists = []
+        self.child_lists = []
 
     def __str__(self):
         return self.filename
 
-    def next_id(self, id_prefix=""):
+    def next_seq(self, id_prefix=""):
         """
-        Allocate the next id for a given prefix
+        Allocate the next sequence number for a given prefix
         """
         if id_prefix in self.last_id:
             self.last_id[id_prefix] += 1
         else:
             self.last_id[id_prefix] = 0
-        return "%s%d" % (id_prefix, self.last_id[id_prefix])
+        return self.last_id[id_prefix]
 
-    def write(self):
+    def next_id(self, id_prefix=""):
+        """
+        Allocate the next id for a given prefix
+        """
+        return "%s%d" % (id_prefix, self.next_seq(id_prefix))
+
+    def node_id(self, index):
+        """Return the id of the node with the given index"""
+        seq = self.id_seqs[index]
+        prefix = self.prefixes[self.id_prefixes[index]]
+        if seq < 0:
+            return prefix
+        return "%s%d" % (prefix, seq)
+
+    def node_at(self, index):
+        """
+        Return the node with the given index. Nodes which have already been
+        written by a streaming Dag are represented by a new Node object.
+        """
+        if index < self.flushed:
+            return Node(id=self.node_id(index))
+        return self.nodes[index - self.flushed]
+
+    def related(self, indexes):
+        """Return the nodes with the given indexes (or None)"""
+        if not indexes:
+            return []
+        return [self.node_at(i) for i in indexes]
+
+    def add_edge(self, parent, child):
+        """
+        Record a dependency between two nodes, given their indexes. An edge
+        which is already recorded is ignored; it is looked for in the
+        shorter of the two lists, so fan-in and fan-out stay cheap.
+        """
+        children = self.child_lists[parent]
+        parents = self.parent_lists[child]
+        if children is not None and parents is not None:
+            if len(children) <= len(parents):
+                if child in children:
+                    return
+            elif parent in parents:
+                return
+        if self.child_lists[parent] is None:
+            self.child_lists[parent] = array('l')
+        self.child_lists[parent].append(child)
+        if self.parent_lists[child] is None:
+            self.parent_lists[child] = array('l')
+        self.parent_lists[child].append(parent)
+
+    def dependencies(self):
+        """
+        Return {node: set of child nodes} for the nodes in this DAG,
+        combining the dependencies declared with parent() and child()
+        """
+        if self.stream:
+            raise ValueError("Nodes of streaming Dag %s are not kept" % self.id)
+        return dict([(n, set(self.related(self.child_lists[n.index])))
+                     for n in self.nodes])
+
+    def topological_order(self, deps=None):
+        """
+        Return the nodes in an order where every node comes after all its
+        parents, and otherwise in the order they were added. Raises
+        ValueError if the dependencies contain a cycle.
+        """
+        from collections import deque
+        if deps is None:
+            deps = self.dependencies()
+        nparents = dict([(n, 0) for n in self.nodes])
+        for children in deps.itervalues():
+            for c in children:
+                nparents[c] += 1
+        ready = deque([n for n in self.nodes if nparents[n] == 0])
+        order = []
+        while ready:
+            n = ready.popleft()
+            order.append(n)
+            for c in sorted(deps[n], key=lambda c: c.index):
+                nparents[c] -= 1
+                if nparents[c] == 0:
+                    ready.append(c)
+        if len(order) < len(self.nodes):
+            raise ValueError("DAG %s contains a cycle" % self.id)
+        return order
+
+    def index_order(self):
+        """
+        Like topological_order(), but returns the node indexes (also
+        covering nodes already written by a streaming Dag)
+        """
+        from collections import deque
+        nparents = [len(p) if p else 0 for p in self.parent_lists]
+        ready = deque([i for (i, n) in enumerate(nparents) if n == 0])
+        order = array('l')
+        while ready:
+            i = ready.popleft()
+            order.append(i)
+            if self.child_lists[i]:
+                for c in sorted(self.child_lists[i]):
+                    nparents[c] -= 1
+                    if nparents[c] == 0:
+                        ready.append(c)
+        if len(order) < len(nparents):
+            raise ValueError("DAG %s contains a cycle" % self.id)
+        return order
+
+    def reduced_parent_lists(self):
+        """
+        Return (parent lists, number of edges removed) for the transitive
+        reduction of the dependencies: an edge A->C is dropped if C is
+        reachable from A by some other path, e.g. A->B->C. Reachability
+        sets are kept as bitsets (python ints) in reverse topological
+        order, and each is freed once all its parents have been processed.
+        """
+        order = self.index_order()
+        n = len(order)
+        bit = [0] * n            # node index => bit number
+        for (pos, i) in enumerate(order):
+            bit[i] = n - 1 - pos # later nodes get lower bits
+        nparents = [len(p) if p else 0 for p in self.parent_lists]
+        reach = {}               # node index => bitset of descendants
+        parent_lists = [None] * n
+        removed = 0
+        for i in reversed(order):
+            children = self.child_lists[i]
+            if not children:
+                reach[i] = 0
+                continue
+            covered = 0
+            for c in sorted(children, key=lambda c: -bit[c]):
+                if (covered >> bit[c]) & 1:
+                    removed += 1
+                else:
+                    if parent_lists[c] is None:
+                        parent_lists[c] = array('l')
+                    parent_lists[c].append(i)
+                covered |= reach[c] | (1 << bit[c])
+                nparents[c] -= 1
+                if nparents[c] == 0:
+                    del reach[c]
+            reach[i] = covered
+        return (parent_lists, removed)
+
+    def downstream_costs(self, cost_model=None):
+        """
+        Return, by node index, the cost of the longest path from each node
+        to the end of the DAG, including the node itself, in a single pass
+        over the nodes in reverse topological order. cost_model is as for
+        simulate(); DONE and NOOP nodes cost nothing. Nodes already written
+        by a streaming Dag are costed from their id alone.
+        """
+        cost = job_cost(cost_model)
+        lengths = array('d', [0.0]) * len(self.parent_lists)
+        for i in reversed(self.index_order()):
+            node = self.node_at(i)
+            if getattr(node, 'done', False) or self.done[i] or getattr(node, 'noop', False):
+                length = 0.0
+            else:
+                length = cost(node)
+            if self.child_lists[i]:
+                length += max([lengths[c] for c in self.child_lists[i]])
+            lengths[i] = length
+        return lengths
+
+    def write_priorities(self, file, cost_model=None):
+        """
+        Give each job a PRIORITY of its downstream_costs() (rounded up), so
+        that dagman submits the jobs on the longest remaining path first.
+        Jobs given a priority explicitly keep it. Jobs still held get a
+        priority var; those already written by a streaming Dag get a
+        PRIORITY line in file.
+        """
+        import math
+        lengths = self.downstream_costs(cost_model)
+        for i in range(self.flushed):
+            if not self.done[i] and i not in self.explicit_priorities:
+                print("PRIORITY %s %d" % (self.node_id(i), int(math.ceil(lengths[i]))),
+                      file=file)
+        for node in self.nodes:
+            if isinstance(node, Job) and not node.done:
+                node.vars.setdefault('priority', int(math.ceil(lengths[node.index])))
+
+    def cache_key(self, func, args, kwargs, processes=None):
+        """
+        Return a hash of a deferred call, for finding its output in the
+        cache; or None if it depends on a job which has no cache key
+        """
+        import hashlib
+        import io
+        class Uncacheable(Exception):
+            pass
+        def persistent_id(obj):
+            if isinstance(obj, Lazy):
+                obj = obj.job
+            if isinstance(obj, Job):
+                if obj.cache_key is None:
+                    raise Uncacheable()
+                return "job:" + obj.cache_key
+            elif isinstance(obj, JobGroup):
+                return ("group",) + tuple([persistent_id(j) for j in obj])
+            elif isinstance(obj, types.FunctionType):
+                return ("func",) + function_identity(obj)
+            elif isinstance(obj, Shared):
+                return "shared:" + obj.filename
+            elif isinstance(obj, Ad):
+                return "ad:%s:%s" % (obj.env, obj.attr)
+            return None
+        buf = io.BytesIO()
+        p = pickle.Pickler(buf, 2)
+        p.persistent_id = persistent_id
+        try:
+            p.dump((function_identity(func), args, kwargs, processes))
+        except (Uncacheable, pickle.PicklingError, TypeError):
+            return None
+        return hashlib.sha1(buf.getvalue()).hexdigest()
+
+    def check_done(self, node):
+        """
+        Mark a job DONE if it completed in an earlier run (see resume_from)
+        or its outputs are already in the cache, and all its parents are
+        DONE; cached jobs also get their usual output filename linked to
+        the cache. The arguments of a DONE job are dropped from its input
+        file.
+        """
+        if not isinstance(node, Job):
+            return
+        done = node.done or str(node) in self.completed
+        if node.cache_key is not None:
+            processes = node.vars.get('processes')
+            cached = output_files(node.id, node['output'], processes)
+            links = output_files(node.id, "%s.%s.out" % (self.id, node.id) +
+                                 (".$(process)" if (processes or 1) > 1 else ""), processes)
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            for (fn, link) in zip(cached, links):
+                target = os.path.relpath(fn, os.path.dirname(link) or ".")
+                if os.path.islink(link) and os.readlink(link) == target:
+                    continue
+                if os.path.lexists(link):
+                    os.unlink(link)
+                os.symlink(target, link)
+            done = done or (all([valid_output(fn) for fn in cached]) and
+                            all([os.path.exists(fn) for fn in node.buffer_files()]))
+        parents = self.parent_lists[node.index] or []
+        if node.done or (done and all([self.done[p] for p in parents])):
+            node.done = True
+            self.done[node.index] = 1
+            inp = node.vars.get('input')
+            if hasattr(inp, 'data'):
+                inp.data.pop(str(node), None)
+                inp.pickled.pop(str(node), None)
+
+    def shared_input(self):
+        """
+        Return the shared input file for the next deferred call, starting
+        a new shard if the current one is full
+        """
+        inp = self.input
+        if ((self.shard_jobs and len(inp.data) + len(inp.index) >= self.shard_jobs) or
+            (self.shard_bytes and inp.nbytes >= self.shard_bytes)):
+            self.shards += 1
+            self.input = Input(filename="%s.%d.in" % (self.id, self.shards),
+                               compression=self.compression)
+            if self.stream and not inp.data:
+                inp.close()
+        return self.input
+
+    def flush(self):
+        """
+        Streaming only: write out all the pending nodes, and forget them
+        """
+        if not self.nodes:
+            return
+        if self.dag_file is None:
+            self.dag_file = open(self.filename, "w")
+        for node in self.nodes:
+            if node.links:
+                self.extra_edges.update([(str(p), str(node)) for p in node.links[0]])
+                self.extra_edges.update([(str(node), str(c)) for c in node.links[1]])
+                node.links = None
+            node.sealed = True
+            self.check_done(node)
+            if isinstance(node, Job) and node.vars.get('priority') is not None:
+                self.explicit_priorities.add(node.index)
+            if isinstance(node, Job):
+                if hasattr(node.submit, 'write'):
+                    node.submit.write()
+                inp = node.vars.get('input')
+                if hasattr(inp, 'append') and str(node) in inp.data:
+                    inp.append(str(node))
+                    # Private and completed input files can be finished now
+                    if (not inp.data and inp is not self.input and
+                        inp not in self.kept_inputs):
+                        inp.close()
+            else:
+                node.write()
+            node.write_dag_entry(file=self.dag_file)
+        self.flushed += len(self.nodes)
+        self.nodes = []
+
+    def write_edges(self, file, parent_lists=None):
+        """
+        Write all the dependencies between nodes. Each edge is written
+        once, and children with the same set of parents are combined into
+        a single PARENT ... CHILD ... line, so fan-in and fan-out patterns
+        need only one line.
+        """
+        groups = {}              # parent indexes => [child index]
+        if parent_lists is None:
+            parent_lists = self.parent_lists
+        for (c, parents) in enumerate(parent_lists):
+            if parents:
+                key = tuple(sorted(parents))
+                if key in groups:
+                    groups[key].append(c)
+                else:
+                    groups[key] = [c]
+        for (parents, children) in sorted(groups.items(), key=lambda x: x[1][0]):
+            print("PARENT %s CHILD %s" % (
+                " ".join(sorted([self.node_id(p) for p in parents])),
+                " ".join(sorted([self.node_id(c) for c in children]))), file=file)
+        # Dependencies with nodes outside this Dag
+        extra = set(self.extra_edges)
+        for node in self.nodes:
+            if node.links:
+                extra.update([(str(p), str(node)) for p in node.links[0]])
+                extra.update([(str(node), str(c)) for c in node.links[1]])
+        for (p, c) in sorted(extra):
+            print("PARENT %s CHILD %s" % (p, c), file=file)
+
+    def share(self, value):
+        """
+        Return value, or a Shared object in its place if its pickle is at
+        least share_bytes. Equal values are only stored once.
+        """
+        if isinstance(value, (Job, JobGroup, Lazy, Ad, Shared)):
+            return value
+        recent = self.shared_ids.get(id(value))
+        if recent is not None and recent[0] is value:
+            return recent[1]
+        data = pickle.dumps(value, pickle_protocol)
+        if len(data) < self.share_bytes:
+            return value
+        import hashlib
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self.shared:
+            self.shared[digest] = Shared(
+                filename="%s.%s.shared" % (self.id, digest[:16]),
+                data=compress(data, self.compression))
+            if self.stream:
+                self.shared[digest].write()
+        # Remember the most recent values, so that passing the same object
+        # again does not pickle it again (keeping a reference to each, so
+        # that its id is not reused while it is remembered)
+        self.shared_ids[id(value)] = (value, self.shared[digest])
+        if len(self.shared_ids) > SHARE_RECENT:
+            self.shared_ids.popitem(last=False)
+        return self.shared[digest]
+
+    def write(self, reduce_edges=False, resume_from=None, auto_priority=False,
+              cost_model=None):
         """
         Write out the DAG. Will recursively write out all its jobs
         and sub-DAGs; each job also writes its input/submit files.
+        A streaming Dag writes its remaining nodes and the dependencies.
+
+        resume_from is a rescue DAG (e.g. "foo.dag.rescue001") or node
+        status file (NODE_STATUS_FILE) from an earlier run, or the DAG file
+        itself to use its latest rescue DAG, or a list of these. Jobs which
+        completed then, and whose parents are all DONE, are marked DONE and
+        their arguments are not written out, so the regenerated DAG only
+        reruns the rest.
+
+        If reduce_edges is true, dependencies which are implied by other
+        dependencies are left out (the transitive reduction), and the
+        number of edges dropped is stored in self.removed_edges. Jobs
+        still run in the same order, so input_files are unaffected.
+
+        If auto_priority is true, each job without an explicit priority is
+        given the length of the longest path from it to the end of the DAG
+        (see downstream_costs; cost_model is as for simulate, default one
+        per job) as its PRIORITY, so that dagman starts the long chains
+        first.
         """
         if not self.written:
+            if resume_from is not None:
+                if self.flushed:
+                    raise ValueError("Streaming Dag %s must be given "
+                                     "resume_from when created" % self.id)
+                self.completed = completed_nodes(resume_from)
             self.written = True
-            with open(self.filename, "w") as f:
+            parent_lists = None
+            if reduce_edges:
+                (parent_lists, self.removed_edges) = self.reduced_parent_lists()
+            if self.stream:
+                self.flush()
+                f = self.dag_file or open(self.filename, "w")
+                self.dag_file = None
+            else:
+                f = open(self.filename, "w")
+            with f:
                 if self.config:
                     print("CONFIG %s.config" % self.id, file=f)
                     with open("%s.config" % self.id, "w") as cf:
                         for (k,v) in self.config.iteritems():
                             print("%s = %s" % (k,v), file=cf)
+                for shared in self.shared.itervalues():
+                    shared.write()
+                if (self.cache_dir is not None or self.completed) and self.nodes:
+                    for i in self.index_order():
+                        if i >= self.flushed:
+                            self.check_done(self.nodes[i - self.flushed])
+                if auto_priority:
+                    self.write_priorities(f, cost_model)
                 for node in self.nodes:
                     node.write()
                     node.write_dag_entry(file=f)
+                self.write_edges(f, parent_lists)
                 for (k,v) in self.maxjobs.iteritems():
                     print("MAXJOBS %s %d" % (k,v), file=f)
+            if self.stream:
+                for inp in [self.input] + self.kept_inputs:
+                    inp.close()
+
+    def run_local(self, workers=None, **run_options):
+        """
+        Run this DAG's jobs on the local machine using a pool of worker
+        processes (default: one per cpu), instead of submitting it to
+        htcondor. Dependencies, MAXJOBS limits per category, retry and job
+        clusters (with procid) are honoured. Jobs run in the current
+        directory and write their output files just as they would under
+        htcondor, so values are passed between jobs in the same way.
+        run_options are passed to run() in each job, e.g. compression.
+
+        Returns {jobid: wall-clock seconds of its slowest process}, not
+        counting time spent waiting for a worker. Raises RuntimeError if
+        any job fails after its retries, or could not be run.
+        """
+        import multiprocessing
+        from collections import deque
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+
+        deps = self.dependencies()
+        self.topological_order(deps)
+        procs = {}               # node => [(id, input, output, procid)]
+        for node in self.nodes:
+            if not isinstance(node, Job):
+                raise ValueError("Cannot run %s locally" % repr(node))
+            inp = node.vars.get('input')
+            if node.noop or node.done:
+                procs[node] = []
+                continue
+            if not hasattr(inp, 'data') or str(node) not in inp.data:
+                raise ValueError("Job %s has no deferred function" % node)
+            try:
+                output = node['output']
+            except KeyError:
+                output = None
+            if output is None:
+                outputs = [None] * (node.vars.get('processes') or 1)
+            else:
+                outputs = output_files(node.id, output, node.vars.get('processes'))
+            procs[node] = [(node.id, inp.filename, out, p)
+                           for (p, out) in enumerate(outputs)]
+            node.write()
+        for shared in self.shared.itervalues():
+            shared.write()
+
+        nparents = dict([(n, 0) for n in self.nodes])
+        for children in deps.itervalues():
+            for c in children:
+                nparents[c] += 1
+        ready = deque([n for n in self.nodes if nparents[n] == 0])
+        byid = dict([(n.id, n) for n in self.nodes])
+        active = {}              # node => [processes left, failures, seconds]
+        categories = {}          # category => number of running nodes
+        attempts = {}            # node => number of failed attempts
+        times = {}
+        failed = []
+        results = queue.Queue()
+
+        def start(node):
+            active[node] = [len(procs[node]), 0, 0.0]
+            for p in procs[node]:
+                pool.apply_async(run_local_process, p + (run_options,),
+                                 callback=results.put)
+
+        def finish(node, ok):
+            (left, failures, seconds) = active.pop(node)
+            cat = node.vars.get('category')
+            if cat is not None:
+                categories[cat] -= 1
+            if not ok:
+                attempts[node] = attempts.get(node, 0) + 1
+                retry = int(str(node.vars.get('retry', 0)).split()[0])
+                if attempts[node] <= retry:
+                    ready.appendleft(node)
+                else:
+                    failed.append(node)
+                return
+            times[node.id] = seconds
+            for c in deps[node]:
+                nparents[c] -= 1
+                if nparents[c] == 0:
+                    ready.append(c)
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            while True:
+                blocked = deque()
+                while ready:
+                    node = ready.popleft()
+                    cat = node.vars.get('category')
+                    if cat is not None:
+                        if categories.get(cat, 0) >= self.maxjobs.get(cat, float('inf')):
+                            blocked.append(node)
+                            continue
+                        categories[cat] = categories.get(cat, 0) + 1
+                    start(node)
+                    if not procs[node]:
+                        finish(node, True)
+                ready.extend(blocked)
+                if not active:
+                    break
+                (id, procid, elapsed, error) = results.get()
+                node = byid[id]
+                if error is not None:
+                    print("HTCONDOR: job %s process %d failed:\n%s" %
+                          (id, procid, error), file=sys.stderr)
+                    active[node][1] += 1
+                active[node][0] -= 1
+                active[node][2] = max(active[node][2], elapsed)
+                if active[node][0] == 0:
+                    finish(node, active[node][1] == 0)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        if len(times) < len(self.nodes):
+            raise RuntimeError("Jobs failed: %s; not run: %s" % (
+                " ".join([str(n) for n in failed]),
+                " ".join([str(n) for n in self.nodes
+                          if n.id not in times and n not in failed])))
+        return times
+
+    def simulate(self, cost_model=None, slots=None):
+        """
+        Estimate how this DAG would run on a pool with the given number of
+        slots (default: unlimited), honouring dependencies, MAXJOBS limits
+        per category and job clusters (one slot per process). Each process
+        of a job takes the time given by cost_model, which is either a
+        dict of {function name: seconds}, or a function taking the Job and
+        returning seconds; unknown jobs take 1 second.
+
+        Returns a Simulation with the makespan, critical path, parallelism
+        profile and time spent waiting per category.
+        """
+        import heapq
+        import itertools
+        from collections import deque
+        cost = job_cost(cost_model)
+        deps = self.dependencies()
+        order = self.topological_order(deps)
+        nparents = dict([(n, 0) for n in self.nodes])
+        for children in deps.itervalues():
+            for c in children:
+                nparents[c] += 1
+
+        # Critical path, ignoring slot and category limits
+        earliest = dict([(n, 0.0) for n in self.nodes])
+        pred = {}
+        for n in order:
+            end = earliest[n] + cost(n)
+            for c in deps[n]:
+                if end > earliest[c]:
+                    earliest[c] = end
+                    pred[c] = n
+        path = []
+        if order:
+            n = max(order, key=lambda n: earliest[n] + cost(n))
+            length = earliest[n] + cost(n)
+            while n is not None:
+                path.append(n)
+                n = pred.get(n)
+            path.reverse()
+        else:
+            length = 0.0
+
+        # Discrete event simulation: dagman submits ready nodes (subject to
+        # MAXJOBS), then their processes queue for free slots
+        res = Simulation(critical_path=path, critical_path_length=length)
+        free = slots if slots is not None else float('inf')
+        queued = deque()         # (node, time queued) for each process
+        waiting = {}             # category => deque of (node, time ready)
+        submitted = {}           # category => number of submitted nodes
+        procs_left = {}
+        events = []              # heap of (time, seq, node)
+        seq = itertools.count()
+        running = 0
+        now = 0.0
+
+        def submit(node, t):
+            cat = node.vars.get('category')
+            if cat is not None:
+                if submitted.get(cat, 0) >= self.maxjobs.get(cat, float('inf')):
+                    waiting.setdefault(cat, deque()).append((node, t))
+                    return
+                submitted[cat] = submitted.get(cat, 0) + 1
+            n = 0 if node.noop or node.done else (node.vars.get('processes') or 1)
+            procs_left[node] = n
+            res.schedule[node.id] = [t, t]
+            if n == 0:
+                heapq.heappush(events, (t, next(seq), node))
+            for p in range(n):
+                queued.append((node, t))
+
+        for n in self.nodes:
+            if nparents[n] == 0:
+                submit(n, 0.0)
+        while True:
+            while queued and free > 0:
+                (node, t) = queued.popleft()
+                res.slot_wait += now - t
+                free -= 1
+                running += 1
+                heapq.heappush(events, (now + cost(node), next(seq), node))
+            res.profile.append((now, running))
+            if not events:
+                break
+            (now, _, node) = heapq.heappop(events)
+            if procs_left[node] > 0:
+                free += 1
+                running -= 1
+                procs_left[node] -= 1
+            if procs_left[node] > 0:
+                continue
+            res.schedule[node.id][1] = now
+            cat = node.vars.get('category')
+            if cat is not None:
+                submitted[cat] -= 1
+                if waiting.get(cat):
+                    (w, t) = waiting[cat].popleft()
+                    res.category_wait[cat] = res.category_wait.get(cat, 0.0) + now - t
+                    submit(w, now)
+            for c in deps[node]:
+                nparents[c] -= 1
+                if nparents[c] == 0:
+                    submit(c, now)
+        res.makespan = now
+        # Only keep the last entry at each instant
+        res.profile = [p for (i, p) in enumerate(res.profile)
+                       if i + 1 == len(res.profile) or res.profile[i+1][0] != p[0]]
+        return res
 
     def write_dag_entry(self, file):
         self.write_dag_header(file)
@@ -338,12 +1499,23 @@ class Dag(Node):
         if self.dir:
             line += " DIR %s" % self.dir
         print(line, file=file)
-        self.write_dag_footer(file)
 
     def node(self, cls, id=None, id_prefix="", **node_options):
         if id is None:
-            id = self.next_id(id_prefix)
+            id = (id_prefix, self.next_seq(id_prefix))
         node = cls(id=id, **node_options)
+        if self.stream:
+            self.flush()
+        if node.prefix not in self.prefix_numbers:
+            self.prefix_numbers[node.prefix] = len(self.prefixes)
+            self.prefixes.append(node.prefix)
+        node.owner = self
+        node.index = len(self.id_seqs)
+        self.id_prefixes.append(self.prefix_numbers[node.prefix])
+        self.id_seqs.append(-1 if node.seq is None else node.seq)
+        self.parent_lists.append(None)
+        self.child_lists.append(None)
+        self.done.append(0)
         self.nodes.append(node)
         return node
 
@@ -362,7 +1534,121 @@ class Dag(Node):
         """
         return self.node(Dag, id=id, **options)
 
-    def defer(self, func=None, id_prefix=None, **vars):
+    def tune_resources(self, logs, percentile=95, headroom=0.2):
+        """
+        Read the user logs (e.g. "mytest.dag.nodes.log") of earlier runs,
+        and from now on give each deferred job the request_memory,
+        request_cpus and request_disk suggested by recommend_resources()
+        for its function, unless set explicitly (on the job or in its
+        submit file). See tuning_report() for what was applied.
+
+        The run time of each function at the percentile is kept in
+        run_times ({function name: seconds}), which can be used as the
+        cost_model of simulate() or write(auto_priority=True).
+        Returns the function_usage() of the logs.
+        """
+        self.resource_usage = function_usage(job_runs(logs), percentile)
+        self.resource_hints = recommend_resources(self.resource_usage, headroom)
+        self.run_times = dict([(func, usage['run_time'][0])
+                               for (func, usage) in self.resource_usage.items()
+                               if 'run_time' in usage])
+        self.tuned = {}
+        return self.resource_usage
+
+    def tuning_report(self):
+        """
+        Return a line for each resource request which tune_resources()
+        changed on the jobs deferred since, with the number of jobs it was
+        applied to and what the earlier jobs used. Requests which were set
+        explicitly on every job, or are the same as before, are left out.
+        """
+        report = []
+        for func in sorted(self.tuned):
+            usage = self.resource_usage[func]
+            for (var, field, units, pad) in TUNED_RESOURCES:
+                jobs = self.tuned[func].get(var)
+                value = self.resource_hints[func].get(var)
+                old = usage['requests'].get(field)
+                if not jobs or old == value:
+                    continue
+                report.append("%s: %s %s -> %d%s on %d jobs (used %.4g%s in %d earlier jobs)" % (
+                    func, var, "unset" if old is None else "%g" % old, value,
+                    units and " " + units, jobs, usage[field][0],
+                    units and " " + units, usage[field][1]))
+        return report
+
+    def map(self, func, iterable, chunksize=100, processes=None,
+            id_prefix=None, **vars):
+        """
+        Call func(item) for every item of iterable, packing chunksize calls
+        into each job - or into each process of a cluster of (at most)
+        processes - rather than creating a job per call. Each job's value
+        is the list of its results. In a cluster, each process's chunk is
+        written to a file of its own (like a Shared value), and a process
+        only transfers and reads its own.
+
+        Returns a JobGroup of the jobs. When passed as an argument to
+        another job, it arrives as one flat list of all the results, in
+        order. Other vars are as for defer().
+        """
+        import hashlib
+        import itertools
+        if id_prefix is None:
+            id_prefix = func.__name__ + '_'
+        items = iter(iterable)
+        group = JobGroup()
+        while True:
+            batch = list(itertools.islice(items, chunksize * (processes or 1)))
+            if not batch:
+                break
+            if processes:
+                chunks = [pickle.dumps(batch[i:i+chunksize], pickle_protocol)
+                          for i in range(0, len(batch), chunksize)]
+                digest = hashlib.sha1(b"".join(chunks)).hexdigest()
+                pattern = "%s.%s.$(process).chunk" % (self.id, digest[:16])
+                for (p, data) in enumerate(chunks):
+                    filename = expand_filename(pattern, None, p)
+                    if filename not in self.shared:
+                        self.shared[filename] = Shared(
+                            filename=filename, data=compress(data, self.compression))
+                        if self.stream:
+                            self.shared[filename].write()
+                job = self.defer(map_chunk, id_prefix=id_prefix,
+                                 processes=len(chunks), **vars)(func, pattern, procid)
+                files = job.vars.get('input_files')
+                job.var(input_files=files + "," + pattern if files else pattern)
+            else:
+                job = self.defer(map_chunk, id_prefix=id_prefix, **vars)(func, batch)
+            job.func = func
+            group.append(job)
+        return group
+
+    def reduce(self, func, jobs, fan_in=16, id_prefix=None, **vars):
+        """
+        Combine the values of many jobs with a tree of jobs, each calling
+        func(*values) on at most fan_in values, so no one job has to read
+        all of them. func must be associative, since it is also applied to
+        its own results. Returns the job at the root of the tree, whose
+        value is the result. Other vars are as for defer().
+
+            total = dag.reduce(add_all, jobs, fan_in=10)
+        """
+        if fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
+        jobs = list(jobs)
+        if not jobs:
+            raise ValueError("reduce() needs at least one job")
+        deferred = self.defer(func, id_prefix=id_prefix, **vars)
+        while True:
+            # split the level into as few, evenly sized, groups as possible
+            n = len(jobs)
+            groups = (n + fan_in - 1) // fan_in
+            jobs = [deferred(*jobs[i * n // groups:(i + 1) * n // groups])
+                    for i in range(groups)]
+            if len(jobs) == 1:
+                return jobs[0]
+
+    def defer(self, func=None, id_prefix=None, lazy=False, **vars):
         """
         Return a function so that defer(settings)(args) creates a condor job.
         This is the core functionality of this library.
@@ -378,26 +1664,99 @@ class Dag(Node):
 
         Pass output=None or error=None if you wish to suppress generation
         of the stdout and stderr files.
+
+        Pass lazy=True to read the values of all the jobs passed as
+        arguments lazily, as if each were wrapped with lazy().
         """
         dag = self
         def deferred(*args, **kwargs):
+            if lazy:
+                args = tuple([Lazy(a) if isinstance(a, Job) else a for a in args])
+                kwargs = dict([(k, Lazy(v) if isinstance(v, Job) else v)
+                               for (k, v) in kwargs.iteritems()])
             job = dag.job(
                 id_prefix=id_prefix or func.__name__+'_',
                 **vars
             )
+            if dag.resource_hints:
+                name = node_function(job.id)
+                submit_vars = getattr(job.submit, 'vars', {})
+                for (k, v) in dag.resource_hints.get(name, {}).iteritems():
+                    if k not in job.vars and k not in submit_vars:
+                        job.vars[k] = v
+                        tuned = dag.tuned.setdefault(name, {})
+                        tuned[k] = tuned.get(k, 0) + 1
             if 'input' not in job.vars:
-                job.var(input=dag.input) # default to dag's shared input file
+                job.var(input=dag.shared_input()) # default to dag's shared input file
+            elif (dag.stream and hasattr(job.vars['input'], 'append') and
+                  job.vars['input'] not in dag.kept_inputs):
+                dag.kept_inputs.append(job.vars['input'])
+            cacheable = dag.cache_dir is not None and 'output' not in job.vars
             if 'output' not in job.vars:
                 job.var(output='%s.%s.out' % (dag.id, job.id))
             if 'error' not in job.vars:
                 job.var(error='%s.%s.err' % (dag.id, job.id))
             job.set_function_data(func, args, kwargs, dag)
+            if cacheable:
+                job.cache_key = dag.cache_key(func, args, kwargs,
+                                              job.vars.get('processes'))
+                if job.cache_key is not None:
+                    # (a result of None is written too, to mark it complete)
+                    job.var(output=os.path.join(dag.cache_dir,
+                                                job.cache_key + '.out'),
+                            output_none=True)
             return job
 
         if func is not None:
             return deferred
 
-        return lambda func: self.defer(func=func, id_prefix=id_prefix, **vars)
+        return lambda func: self.defer(func=func, id_prefix=id_prefix,
+                                       lazy=lazy, **vars)
+
+class Simulation(object):
+    """
+    The result of Dag.simulate():
+      makespan             - time until the last job finishes
+      critical_path        - the longest chain of jobs, ignoring limits
+      critical_path_length - its total cost
+      profile              - [(time, number of processes running)]
+      schedule             - {jobid: [submit time, finish time]}
+      category_wait        - {category: total time nodes waited for MAXJOBS}
+      slot_wait            - total time processes waited for a free slot
+    """
+    def __init__(self, critical_path, critical_path_length):
+        self.makespan = 0.0
+        self.critical_path = critical_path
+        self.critical_path_length = critical_path_length
+        self.profile = []
+        self.schedule = {}
+        self.category_wait = {}
+        self.slot_wait = 0.0
+
+    def __repr__(self):
+        return "Simulation(makespan=%s,critical_path_length=%s)" % (
+            self.makespan, self.critical_path_length)
+
+    def bottlenecks(self):
+        """Return [(category, wait)] with the most delayed category first"""
+        return sorted(self.category_wait.items(), key=lambda x: -x[1])
+
+def job_cost(cost_model=None):
+    """
+    Turn a cost model (None for unit cost, a dict of {function name:
+    seconds}, or a function of the Job) into a function of the Job. Jobs
+    without a function are looked up by the function name part of their
+    id (see node_function).
+    """
+    if cost_model is None:
+        return lambda job: 1.0
+    elif hasattr(cost_model, 'get'):
+        def cost(job):
+            name = (getattr(getattr(job, 'func', None), '__name__', None) or
+                    node_function(job.id))
+            return float(cost_model.get(name, 1.0))
+        return cost
+    return cost_model
 
 class Ad(object):
     """An object which represents a run-time value of a classAd attribute.
@@ -427,23 +1786,23 @@ def running():
     """Return true if running as a htcondor job"""
     return '_CONDOR_JOB_AD' in os.environ
 
+# A line of a classAd file: attr = "string" | integer | other expression
+AD_LINE = re.compile(r'^(\w+)\s*=\s*(?:"(.*)"|(\d+)|(.*))$')
+
 def parse_ad(filename):
     """Read a classAd-formatted file and return a dict of {attr:val}"""
     ad = {}
     with open(filename) as f:
         for line in f:
-            m = re.match('^(\w+)\s*=\s*"(.*)"$', line)
-            if m:
-                ad[m.group(1)] = m.group(2)  # TODO: dequote internal \" ?
-                continue
-            m = re.match('^(\w+)\s*=\s*(\d+)$', line)
-            if m:
-                ad[m.group(1)] = int(m.group(2))
-                continue
-            m = re.match('^(\w+)\s*=\s*(.*)$', line)
+            m = AD_LINE.match(line)
             if m:
-                ad[m.group(1)] = m.group(2)
-                continue
+                (attr, string, number, other) = m.groups()
+                if string is not None:
+                    ad[attr] = string  # TODO: dequote internal \" ?
+                elif number is not None:
+                    ad[attr] = int(number)
+                else:
+                    ad[attr] = other
     return ad
 
 ads = {}
@@ -457,34 +1816,398 @@ def ad_attr(attr, env='_CONDOR_JOB_AD'):
     else:
         return Ad(attr, env)
 
+def ad_int(attr, env='_CONDOR_JOB_AD'):
+    """
+    Return an integer classAd value, or None if the ad or attribute is not
+    available or is not an integer
+    """
+    if env not in ads:
+        if env not in os.environ:
+            return None
+        ads[env] = parse_ad(os.environ[env])
+    value = ads[env].get(attr)
+    return value if isinstance(value, int) else None
+
 def output_files(id, filename, processes=None):
     """
     Return a list of filenames of all the outputs for a job (cluster)
     """
-    base = re.sub(r'\$\(jobname\)',str(id),filename,flags=re.IGNORECASE)
-    return [re.sub(r'\$\(process\)',str(p),base,flags=re.IGNORECASE)
-            for p in range(processes or 1)]
+    return [expand_filename(filename, id, p) for p in range(processes or 1)]
+
+def expand_filename(filename, id, procid=0):
+    """Expand $(jobname) and $(process) in a filename"""
+    filename = re.sub(r'\$\(jobname\)',str(id),filename,flags=re.IGNORECASE)
+    return re.sub(r'\$\(process\)',str(procid),filename,flags=re.IGNORECASE)
 
-def read_job_output(id, filename, processes=None):
+# Node status file (DAGMan NODE_STATUS_FILE) attributes
+NODE_STATUS_RE = re.compile(r'\s*(?:Node\s*=\s*"([^"]*)"|NodeStatus\s*=\s*(\d+))\s*;')
+STATUS_DONE = 5
+
+def completed_nodes(filename):
+    """
+    Return the set of node names which completed in an earlier run of a
+    DAG, as recorded in a rescue DAG ("DONE name" lines) or a node status
+    file (NodeStatus = 5). If filename is a DAG file, its latest rescue
+    DAG is used (none: nothing completed). filename may also be None, or
+    a list of filenames.
+    """
+    if filename is None:
+        return set()
+    if isinstance(filename, (list, tuple, set)):
+        done = set()
+        for fn in filename:
+            done.update(completed_nodes(fn))
+        return done
+    if not re.search(r'\.rescue\d+$', filename):
+        import glob
+        rescues = sorted([fn for fn in glob.glob(filename + ".rescue*")
+                          if re.search(r'\.rescue\d+$', fn)])
+        if rescues:
+            filename = rescues[-1]
+        elif filename.endswith('.dag'):
+            return set()
+    done = set()
+    node = None
+    with open(filename) as f:
+        for line in f:
+            m = NODE_STATUS_RE.match(line)
+            if m:
+                if m.group(1) is not None:
+                    node = m.group(1)
+                elif node is not None and int(m.group(2)) == STATUS_DONE:
+                    done.add(node)
+                continue
+            words = line.split()
+            if len(words) >= 2 and words[0].upper() == 'DONE':
+                done.add(words[1])
+            elif (len(words) >= 3 and words[0].upper() == 'JOB' and
+                  'DONE' in [w.upper() for w in words[3:]]):
+                done.add(words[1])
+    return done
+
+def function_identity(func):
+    """
+    Return a picklable description of a function which changes whenever
+    its code, default arguments or closed-over values do, for use in cache
+    keys. Changes to other functions it calls, or to globals it reads, are
+    not detected.
+    """
+    def code_identity(code):
+        return (code.co_code, code.co_names,
+                tuple([code_identity(c) if hasattr(c, 'co_code') else c
+                       for c in code.co_consts]))
+    def cell_contents(cell):
+        try:
+            value = cell.cell_contents
+        except ValueError:       # (not yet assigned)
+            return ('empty',)
+        return ('self',) if value is func else value
+    ident = (getattr(func, '__module__', None),
+             getattr(func, '__name__', repr(func)))
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        ident += (code_identity(code),
+                  getattr(func, '__defaults__', None),
+                  getattr(func, '__kwdefaults__', None),
+                  tuple([cell_contents(c) for c in func.__closure__ or ()]))
+    return ident
+
+def valid_output(filename):
+    """
+    Return true if filename looks like a complete output written by run().
+    Cached jobs always write their output, even None, so an empty file is
+    incomplete; a compressed one is decompressed to check it.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            head = f.read(6)
+            if not head:
+                return False
+            if codec_of(head) is None:
+                f.seek(-1, 2)
+                tail = f.read(1)
+            else:
+                try:
+                    tail = decompress(head + f.read())[-1:]
+                except Exception:       # truncated or corrupt
+                    return False
+            return tail == b'.'         # pickle STOP opcode
+    except (IOError, OSError):
+        return False
+
+def local_file(filename):
+    """
+    Input files are transferred into the job's working directory, so at
+    runtime a file which is not at its original path is found there
+    """
+    if not os.path.exists(filename) and os.path.exists(os.path.basename(filename)):
+        return os.path.basename(filename)
+    return filename
+
+# Number of threads used to read the outputs of a cluster
+READ_THREADS = 8
+
+def read_job_output(id, filename, processes=None, lazy=False):
     """
     If job B uses the value of job A in its arguments, we have to read that
     value at runtime. This is done when job B's arguments are unpickled.
-    If the job was a cluster, return all the values as a list.
+    If the job was a cluster, return all the values as a list; the files
+    are read by a pool of threads. With lazy=True (see lazy()), return a
+    LazyValue, or an OutputSequence for a cluster.
     """
     if running():
         if filename is None:
             return None
-        elif processes is None:
-            with open(output_files(id, filename, None)[0], 'rb') as f:
-                return pickle.load(f)
+        filenames = [local_file(fn) for fn in output_files(id, filename, processes)]
+        if processes is None:
+            return LazyValue(filenames[0]) if lazy else read_output(filenames[0])
+        elif lazy:
+            return OutputSequence(filenames)
+        elif len(filenames) == 1:
+            return [read_output(filenames[0])]
+        from multiprocessing.pool import ThreadPool
+        start = time.time()
+        pool = ThreadPool(min(len(filenames), READ_THREADS))
+        try:
+            data = pool.map(read_file, filenames)
+        finally:
+            pool.close()
+            pool.join()
+        count_stats('outputs', time.time() - start, sum([len(d) for d in data]))
+        import io
+        res = []
+        data.reverse()
+        for fn in filenames:
+            start = time.time()
+            res.append(load_value(io.BytesIO(data.pop()), output_sidecar(fn)))
+            count_stats('outputs', time.time() - start)
+        return res
+    else:
+        job = Job(id=id, submit=None, output=filename, processes=processes)
+        return Lazy(job) if lazy else job
+
+def read_group_output(jobs):
+    """
+    Read the values of the jobs of a Dag.map(), given (id, output,
+    processes) for each, and return all their results as one flat list
+    """
+    if not running():
+        return JobGroup([Job(id=id, submit=None, output=filename, processes=processes)
+                         for (id, filename, processes) in jobs])
+    res = []
+    for (id, filename, processes) in jobs:
+        value = read_job_output(id, filename, processes)
+        if processes is None:
+            res.extend(value)
         else:
-            res = []
-            for fn in output_files(id, filename, processes):
-                with open(fn, 'rb') as f:
-                    res.append(pickle.load(f))
-            return res
+            for part in value:
+                res.extend(part)
+    return res
+
+def map_chunk(func, items, procid=None):
+    """
+    Run a chunk of the calls of a Dag.map(). In a cluster, items is the
+    name of the file holding each process's chunk, with $(process) in it.
+    """
+    if procid is not None:
+        items = read_shared(expand_filename(items, None, procid))
+    return [func(item) for item in items]
+
+def read_file(filename):
+    """Return the contents of a file"""
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def output_sidecar(filename):
+    """Return the buffers sidecar of an output file, or None if there is none"""
+    sidecar = filename + '.buf'
+    return sidecar if os.path.exists(sidecar) else None
+
+def read_output(filename):
+    """Return the value in a job's output file"""
+    start = time.time()
+    with open(filename, 'rb') as f:
+        value = load_value(f, output_sidecar(filename))
+        count_stats('outputs', time.time() - start, f.tell())
+    return value
+
+class LazyValue(object):
+    """
+    A proxy for the value of a job, which is read from its output file the
+    first time it is used: attributes, operators, len(), iteration etc. are
+    passed on to the value. Use resolve() to get the value itself, e.g.
+    for isinstance() or to pass it to code which needs the real type.
+    """
+    __slots__ = ('_filename', '_value', '_loaded')
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._loaded = False
+        self._value = None
+
+    def _resolve(self):
+        if not self._loaded:
+            self._value = read_output(self._filename)
+            self._loaded = True
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __nonzero__(self):
+        return bool(self._resolve())
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        if self._loaded:
+            return repr(self._value)
+        return "LazyValue(%r)" % (self._filename,)
+
+    def __str__(self):
+        return str(self._resolve())
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+    def __reduce__(self):
+        return (identity, (self._resolve(),))
+
+def _lazy_method(name):
+    def method(self, *args):
+        return getattr(self._resolve(), name)(*args)
+    method.__name__ = name
+    return method
+
+def _lazy_operator(name, op, reflected=False):
+    if reflected:
+        method = lambda self, other: op(other, self._resolve())
     else:
-        return Job(id=id, submit=None, output=filename, processes=processes)
+        method = lambda self, other: op(self._resolve(), other)
+    method.__name__ = name
+    return method
+
+for _name in ['__len__', '__iter__', '__getitem__', '__setitem__',
+              '__delitem__', '__contains__', '__call__', '__enter__',
+              '__exit__', '__int__', '__long__', '__float__', '__index__',
+              '__neg__', '__pos__', '__abs__', '__invert__']:
+    setattr(LazyValue, _name, _lazy_method(_name))
+for _name in ['eq', 'ne', 'lt', 'le', 'gt', 'ge']:
+    setattr(LazyValue, '__%s__' % _name,
+            _lazy_operator('__%s__' % _name, getattr(operator, _name)))
+for _name in ['add', 'sub', 'mul', 'div', 'truediv', 'floordiv', 'mod',
+              'pow', 'and', 'or', 'xor', 'lshift', 'rshift']:
+    _op = getattr(operator, _name, None) or getattr(operator, _name + '_', None)
+    if _op is not None:
+        setattr(LazyValue, '__%s__' % _name, _lazy_operator('__%s__' % _name, _op))
+        setattr(LazyValue, '__r%s__' % _name,
+                _lazy_operator('__r%s__' % _name, _op, reflected=True))
+
+def identity(value):
+    return value
+
+def resolve(value):
+    """Return the value behind a LazyValue, or value itself otherwise"""
+    if isinstance(value, LazyValue):
+        return value._resolve()
+    return value
+
+class OutputSequence(object):
+    """
+    The values of a job cluster, read lazily: each process's output is
+    unpickled when its element is accessed, and is not kept. Iterating
+    over the sequence holds only one value in memory at a time.
+    """
+    def __init__(self, filenames):
+        self.filenames = filenames
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return read_output(self.filenames[i])
+
+    def __iter__(self):
+        for fn in self.filenames:
+            yield read_output(fn)
+
+    def __repr__(self):
+        return "OutputSequence(%r)" % (self.filenames,)
+
+def read_input(src, job_name=None):
+    """
+    Read a job input file written by Input.write(). If job_name is given,
+    seek straight to that job's record and return (func,args,kwargs);
+    otherwise return the whole {"jobname":(func,args,kwargs)} dict.
+    Files holding a single pickled dict (the old format) are also accepted.
+    Raises KeyError if job_name is not present.
+    """
+    head = src.read(len(INPUT_MAGIC))
+    if head != INPUT_MAGIC:
+        data = pickle.loads(decompress(head + src.read()))
+        if job_name is None:
+            return data
+        count_stats('input', 0.0, src.tell())
+        return data[job_name]
+    src.seek(-INPUT_TRAILER.size, 2)
+    (pos, count) = INPUT_TRAILER.unpack(src.read(INPUT_TRAILER.size))
+    if job_name is not None:
+        (offset, length) = find_input_record(src, pos, count, job_name)
+        src.seek(offset)
+        count_stats('input', 0.0, length)
+        return pickle.loads(decompress(src.read(length)))
+    src.seek(pos)
+    table = src.read(count * INPUT_ENTRY.size)
+    data = {}
+    for i in range(count):
+        (name_pos, name_len, offset, length) = INPUT_ENTRY.unpack_from(
+            table, i * INPUT_ENTRY.size)
+        src.seek(name_pos)
+        name = src.read(name_len)
+        src.seek(offset)
+        data[name] = pickle.loads(decompress(src.read(length)))
+    return data
+
+def find_input_record(src, pos, count, job_name):
+    """
+    Binary search the index of an input file (count entries at pos) for a
+    job, and return the (offset, length) of its record. Raises KeyError if
+    it is not there.
+    """
+    key = job_name.encode('utf-8') if isinstance(job_name, unicode) else job_name
+    (lo, hi) = (0, count)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        src.seek(pos + mid * INPUT_ENTRY.size)
+        (name_pos, name_len, offset, length) = INPUT_ENTRY.unpack(
+            src.read(INPUT_ENTRY.size))
+        src.seek(name_pos)
+        name = src.read(name_len)
+        if name < key:
+            lo = mid + 1
+        elif name > key:
+            hi = mid
+        else:
+            return (offset, length)
+    raise KeyError(job_name)
+
+shared_values = {}
+
+def read_shared(filename):
+    """
+    Return the value stored in a Shared file. At runtime each file is only
+    unpickled once, however many arguments refer to it.
+    """
+    if running():
+        if filename not in shared_values:
+            start = time.time()
+            with open(local_file(filename), 'rb') as f:
+                shared_values[filename] = load_value(f)
+                count_stats('shared', time.time() - start, f.tell())
+        return shared_values[filename]
+    else:
+        return Shared(filename=filename, data=None)
 
 def invoke(job_data):
     """
@@ -493,21 +2216,324 @@ def invoke(job_data):
     write a backtrace to stderr and exit with a non-zero code, which is
     what we want for htcondor.
     """
-    (func, args, kwargs) = job_data
+    (func, args, kwargs) = job_data[:3]
+    options = job_data[3] if len(job_data) > 3 else {}
+    if options.get('profile'):
+        return profile_call(options['profile'], func, args, kwargs)
     return func(*args, **kwargs)     # apply(*job_data) is deprecated
 
-def run(src=sys.stdin, dst=sys.stdout, output_none=False):
+def run(src=sys.stdin, dst=sys.stdout, output_none=False, compression=None,
+        stats=None, tune=False):
     if src.isatty():
         print('%s is non-interactive, requires a pickled argument set' % sys.argv[0], file=sys.stderr)
         sys.exit(1)
     else:
+        global job_stats
         job_name = re.sub(r'^.*\+','',ad_attr('DAGNodeName'))  # FIXME: use a command-line argument?
-        data = pickle.load(src)
-        if job_name not in data:
-            raise KeyError("Job name '%s' not found in job input" % job_name)
-        res = invoke(data[job_name])
-        if res is not None or output_none:
-            pickle.dump(res, dst, pickle_protocol)
+        if tune:
+            tune_environment()
+        if stats:
+            job_stats = new_stats()
+        try:
+            start = time.time()
+            try:
+                job_data = read_input(src, job_name)
+            except KeyError:
+                raise KeyError("Job name '%s' not found in job input" % job_name)
+            if job_stats is not None:
+                # (time spent reading upstream outputs is counted separately)
+                seconds = job_stats['seconds']
+                count_stats('input', time.time() - start -
+                            seconds.get('outputs', 0.0) - seconds.get('shared', 0.0))
+            start = time.time()
+            res = invoke(job_data)
+            count_stats('call', time.time() - start)
+            start = time.time()
+            options = job_data[3] if len(job_data) > 3 else {}
+            buffers = options.get('buffers')
+            output_none = output_none or options.get('output_none')
+            if buffers:
+                sidecar = expand_filename(buffers[1], job_name, running_procid())
+                if not os.path.isdir(os.path.dirname(sidecar) or "."):
+                    sidecar = os.path.basename(sidecar)
+            if res is not None or output_none:
+                if compression is None and job_stats is None and not buffers:
+                    pickle.dump(res, dst, pickle_protocol)
+                else:
+                    if buffers:
+                        data = dumps_buffers(res, sidecar, buffers[0])
+                    else:
+                        data = pickle.dumps(res, pickle_protocol)
+                    if compression is not None:
+                        data = compress(data, compression)
+                    dst.write(data)
+                    if job_stats is not None:
+                        job_stats['bytes_written'] = len(data) + (
+                            os.path.getsize(sidecar) if buffers else 0)
+            elif buffers:
+                # Consumers transfer the sidecar, so it must exist
+                open(sidecar, 'wb').close()
+            count_stats('write', time.time() - start)
+        except BaseException as e:
+            if job_stats is not None:
+                job_stats['error'] = "%s: %s" % (type(e).__name__, e)
+            raise
+        finally:
+            if job_stats is not None:
+                write_stats(job_name, stats)
+                job_stats = None
+
+############################################################
+#
+# Resources of the slot a job is running in
+#
+############################################################
+
+# (resource, machine ad attribute, job ad attribute)
+SLOT_RESOURCES = [
+    ('cpus', 'Cpus', 'RequestCpus'),
+    ('memory', 'Memory', 'RequestMemory'),   # MB
+    ('disk', 'Disk', 'RequestDisk'),         # KB
+    ('gpus', 'Gpus', 'RequestGpus'),
+]
+
+# Environment variables for the thread pools of numerical libraries
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+slot = None   # cached by slot_resources()
+
+def slot_resources():
+    """
+    Return {'cpus': n, 'memory': MB, 'disk': KB, 'gpus': n} for the slot
+    this job is running in, from the machine ad (Cpus, Memory...) or else
+    the job ad (RequestCpus, RequestMemory...); None where unknown. When
+    not running under htcondor, cpus is the number of cpus of this
+    machine. The ads are only read once.
+    """
+    global slot
+    if slot is None:
+        slot = {}
+        for (name, machine_attr, job_attr) in SLOT_RESOURCES:
+            value = ad_int(machine_attr, '_CONDOR_MACHINE_AD')
+            if value is None:
+                value = ad_int(job_attr)
+            slot[name] = value
+        if not slot['cpus']:
+            import multiprocessing
+            slot['cpus'] = multiprocessing.cpu_count() if not running() else 1
+    return slot
+
+def tune_environment():
+    """
+    Size the thread pools of numerical libraries (OMP_NUM_THREADS etc.)
+    to the slot's cpus, except for any which are already set. This must
+    happen before the libraries are imported. Returns slot_resources().
+    """
+    resources = slot_resources()
+    for var in THREAD_ENV_VARS:
+        os.environ.setdefault(var, str(resources['cpus']))
+    return resources
+
+def memory_budget(fraction=0.8):
+    """
+    Return the number of bytes a job may use for its data: a fraction of
+    the slot's memory, leaving the rest for python itself. None if the
+    slot's memory is unknown.
+    """
+    memory = slot_resources()['memory']
+    if memory is None:
+        return None
+    return int(memory * 1024 * 1024 * fraction)
+
+def slot_executor(processes=False):
+    """
+    Return a concurrent.futures executor with a worker per cpu of the
+    slot: threads, or processes if processes is true. Where
+    concurrent.futures is not available (python 2 without the futures
+    package), a multiprocessing pool is returned instead; both have map().
+    """
+    workers = slot_resources()['cpus']
+    try:
+        import concurrent.futures
+    except ImportError:
+        if processes:
+            from multiprocessing import Pool
+        else:
+            from multiprocessing.pool import ThreadPool as Pool
+        return Pool(workers)
+    if processes:
+        return concurrent.futures.ProcessPoolExecutor(workers)
+    return concurrent.futures.ThreadPoolExecutor(workers)
+
+############################################################
+#
+# Statistics of running jobs
+#
+############################################################
+
+job_stats = None   # statistics of the running job, see run(stats=...)
+
+def new_stats():
+    """Return an empty set of job statistics, starting now"""
+    import socket
+    stats = {'host': socket.gethostname(), 'start': time.time(),
+             'seconds': {}, 'bytes_read': 0, 'bytes_written': 0}
+    if startup_seconds is not None:
+        stats['seconds']['startup'] = startup_seconds
+    return stats
+
+def count_stats(phase, seconds, nbytes=0):
+    """Add to the statistics of the running job, if they are being kept"""
+    if job_stats is not None:
+        job_stats['seconds'][phase] = job_stats['seconds'].get(phase, 0.0) + seconds
+        job_stats['bytes_read'] += nbytes
+
+def peak_rss():
+    """Return the peak RSS of this process in kB, or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def write_stats(job_name, directory):
+    """
+    Write the statistics of the running job to
+    <directory>/<job_name>.<procid>.stats.json, where directory is "."
+    if it is not a string. Files written in the job's directory are
+    transferred back by htcondor along with its output.
+    """
+    import json
+    if not isinstance(directory, basestring):
+        directory = "."
+    elif not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):   # (not made by another job)
+                raise
+    job_stats.update(node=job_name, procid=running_procid(),
+                     peak_rss_kb=peak_rss())
+    job_stats['seconds']['total'] = time.time() - job_stats['start']
+    filename = os.path.join(directory, job_filename("stats.json", job_name))
+    with open(filename, 'w') as f:
+        json.dump(job_stats, f, sort_keys=True)
+
+def running_procid():
+    """Return the process number of the running job within its cluster"""
+    try:
+        return int(ad_attr('ProcId'))
+    except KeyError:
+        return 0
+
+def job_filename(suffix, job_name=None):
+    """Return <node>.<procid>.<suffix> for the running job"""
+    if job_name is None:
+        job_name = re.sub(r'^.*\+','',ad_attr('DAGNodeName'))
+    return "%s.%d.%s" % (job_name, running_procid(), suffix)
+
+def collect_stats(directory="."):
+    """
+    Read all the job statistics files in a directory, and return them as
+    a list of dicts with the slowest job first
+    """
+    import glob
+    import json
+    rows = []
+    for fn in glob.glob(os.path.join(directory, "*.stats.json")):
+        with open(fn) as f:
+            rows.append(json.load(f))
+    return sorted(rows, key=lambda r: -r['seconds'].get('total', 0.0))
+
+STATS_PHASES = ['startup', 'input', 'outputs', 'shared', 'call', 'write', 'total']
+
+def print_stats(rows, file=sys.stdout, limit=None):
+    """
+    Print a table of job statistics from collect_stats(), then the total
+    and mean time per host
+    """
+    print("%-30s %-20s %s %10s %10s %9s" % (
+        "node", "host", " ".join(["%8s" % p for p in STATS_PHASES]),
+        "read", "written", "rss_kb"), file=file)
+    for r in rows[:limit]:
+        print("%-30s %-20s %s %10d %10d %9s" % (
+            "%s.%d" % (r['node'], r['procid']), r['host'],
+            " ".join(["%8.3f" % r['seconds'].get(p, 0.0) for p in STATS_PHASES]),
+            r['bytes_read'], r['bytes_written'], r['peak_rss_kb']) +
+            (" " + r['error'] if r.get('error') else ""), file=file)
+    hosts = {}
+    for r in rows:
+        hosts.setdefault(r['host'], []).append(r['seconds'].get('total', 0.0))
+    print("\n%-20s %6s %10s %8s" % ("host", "jobs", "total", "mean"), file=file)
+    for (host, times) in sorted(hosts.items(), key=lambda x: -sum(x[1])):
+        print("%-20s %6d %10.3f %8.3f" % (
+            host, len(times), sum(times), sum(times) / len(times)), file=file)
+
+def run_local_process(id, input, output, procid, run_options):
+    """
+    Run one process of a job within a worker of Dag.run_local(), as if it
+    were running under htcondor. Returns (id, procid, seconds, error)
+    where error is the formatted traceback, or None on success.
+    """
+    import time
+    import traceback
+    os.environ['_CONDOR_JOB_AD'] = ''
+    ads.clear()
+    ads['_CONDOR_JOB_AD'] = {'DAGNodeName': id, 'ProcId': procid}
+    start = time.time()
+    try:
+        with open(input, 'rb') as src:
+            with open(output or os.devnull, 'wb') as dst:
+                run(src=src, dst=dst, **run_options)
+    except (Exception, SystemExit):
+        return (id, procid, time.time() - start, traceback.format_exc())
+    return (id, procid, time.time() - start, None)
+
+############################################################
+#
+# Profiling jobs
+#
+############################################################
+
+PROFILE_MODES = ['cpu']
+
+def profile_call(mode, func, args, kwargs):
+    """
+    Call func(*args, **kwargs) under cProfile (mode 'cpu'), writing the
+    profile to <node>.<procid>.<mode>.prof in the job's directory so that
+    htcondor transfers it back.
+    """
+    import cProfile
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        prof.dump_stats(job_filename(mode + ".prof"))
+
+def profile_files(func, mode='cpu', directory="."):
+    """
+    Return the profiles written by the jobs of a function (or with a given
+    id prefix, e.g. "adder_")
+    """
+    import glob
+    prefix = func if isinstance(func, basestring) else func.__name__ + '_'
+    pattern = re.compile(r'^%s\d+\.\d+\.%s\.prof$' % (re.escape(prefix), mode))
+    return sorted([fn for fn in glob.glob(os.path.join(directory, prefix + "*"))
+                   if pattern.match(os.path.basename(fn))])
+
+def merge_profiles(func, mode='cpu', directory="."):
+    """
+    Merge the profiles from all the jobs of a function into a pstats.Stats
+    object (e.g. use .sort_stats('cumulative').print_stats(20)). Returns
+    None if there are none.
+    """
+    import pstats
+    files = profile_files(func, mode, directory)
+    if not files:
+        return None
+    return pstats.Stats(*files)
 
 def autorun(report_hostname=True, *args, **kwargs):
     """
@@ -521,7 +2547,25 @@ def autorun(report_hostname=True, *args, **kwargs):
     If you pass report_hostname=True then a line is written to stderr saying
     the name of the host where the job is run. This can be useful to pin
     down problems with a particular server.
+
+    Pass compression='zlib' (or another codec in CODECS) to compress the
+    value written to the job's output file.
+
+    Pass stats=True (or a directory name) to have each job write the time
+    spent in each phase, bytes read and written, peak RSS and hostname to
+    <node>.<procid>.stats.json; see collect_stats() and print_stats().
+
+    Pass tune=True to size the thread pools of numerical libraries to the
+    slot's cpus before the job's arguments are unpickled (see
+    tune_environment). Note that your script's own imports come first,
+    unless the jobs run in a Dag(worker=True).
+
+    The options are also passed on to the jobs of a Dag(worker=True), so
+    call autorun() before creating the Dag.
     """
+    if worker_script is not None:
+        raise StopScript()
+    autorun_options.update(kwargs, report_hostname=report_hostname)
     if running():
         if report_hostname:
             import socket
@@ -530,22 +2574,577 @@ def autorun(report_hostname=True, *args, **kwargs):
         sys.exit(0)
     elif 'UNPICKLE' in os.environ:
         import pprint
-        data = pickle.load(open(os.environ['UNPICKLE'], 'rb'))
-        if len(sys.argv) > 1:
-            jobid = sys.argv[1]
-            if jobid not in data:
-                print("Job '%s' not in input" % jobid, file=sys.stderr)
-                sys.exit(1)
-            data = data[jobid]
+        with open(os.environ['UNPICKLE'], 'rb') as f:
+            if len(sys.argv) > 1:
+                jobid = sys.argv[1]
+                try:
+                    data = read_input(f, jobid)
+                except KeyError:
+                    print("Job '%s' not in input" % jobid, file=sys.stderr)
+                    sys.exit(1)
+            else:
+                data = read_input(f)
         pprint.pprint(data)
         sys.exit(0)
 
-# Another option is to set Executable = htcondor_dag.py in submit file.
-# For this to work, when you write the dag file the functions must have
-# been imported from a different module, not implicitly __main__. Note
-# also that the executable is renamed to "condor_exec.exe", so other
-# code will not see htcondor_dag.py and hence cannot import htcondor_dag
+autorun_options = {}   # as given to autorun() when generating the DAG
+
+############################################################
+#
+# Reading htcondor user logs
+#
+############################################################
+
+# The first line of an event, e.g.
+#   005 (123.000.000) 2024-01-31 10:00:00 Job terminated.
+#   001 (123.000.000) 01/31 10:00:00 Job executing on host: <10.0.0.1:9618>
+LOG_EVENT = re.compile(
+    r'^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\d+[-/]\d+(?:[-/]\d+)?)[ T](\d+):(\d+):(\d+)\S* ?(.*)')
+# Lines within an event
+LOG_VALUE = re.compile(r'^\s*(-?[\d.]+)\s+-\s+(.*?)\s*$')
+LOG_USAGE = re.compile(
+    r'Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+(.*?)\s*$')
+LOG_RESOURCE = re.compile(r'^\s*(\w+)(?: \((\w+)\))?\s*:\s*([\d.]+)\s+([\d.]+)\s+([\d.]+)')
+LOG_RETURN = re.compile(r'\((?:return value|signal) (\d+)\)')
+
+def log_time(date, hh, mm, ss, days={}):
+    """Convert the date and time of a user log event to seconds since the epoch"""
+    if date not in days:
+        parts = [int(x) for x in re.split('[-/]', date)]
+        if len(parts) == 2:             # MM/DD, without the year
+            parts = [time.localtime().tm_year] + parts
+        days[date] = time.mktime((parts[0], parts[1], parts[2], 0, 0, 0, 0, 0, -1))
+    return days[date] + int(hh) * 3600 + int(mm) * 60 + int(ss)
+
+def read_user_log(filename):
+    """
+    Read a htcondor user log (or a DAGMan nodes log) one event at a time,
+    yielding a dict for each event with:
+      code, cluster, proc, time (seconds since the epoch), text (the rest
+      of the first line), lines (the other lines)
+    plus, where present:
+      node        - "DAG Node:" of a submit event
+      host        - where the job is executing (SlotName, or the address)
+      values      - {label: number} for "number - label" lines
+      usage       - {label: cpu seconds} for "Usr ..., Sys ... - label"
+      resources   - {"Cpus"/"Memory"/"Disk"/"Gpus": (usage, request, allocated)}
+      return_value, signal - of a terminated job
+    filename may also be a list of filenames.
+    """
+    if not isinstance(filename, basestring):
+        for fn in filename:
+            for event in read_user_log(fn):
+                yield event
+        return
+    event = None
+    with open(filename) as f:
+        for line in f:
+            if event is None:
+                m = LOG_EVENT.match(line)
+                if m:
+                    event = {'code': int(m.group(1)), 'cluster': int(m.group(2)),
+                             'proc': int(m.group(3)),
+                             'time': log_time(*m.group(4, 5, 6, 7)),
+                             'text': m.group(8).strip(), 'lines': []}
+                    if event['code'] == 1 and '<' in line:
+                        event['host'] = line.split('<', 1)[1].split(':', 1)[0].split('>')[0]
+            elif line.startswith('...'):
+                yield parse_log_event(event)
+                event = None
+            else:
+                event['lines'].append(line.rstrip('\n'))
+
+def parse_log_event(event):
+    """Fill in the values from the lines of a user log event"""
+    for line in event['lines']:
+        text = line.strip()
+        if text.startswith('DAG Node:'):
+            event['node'] = text.split(':', 1)[1].strip()
+        elif text.startswith('SlotName:'):
+            event['host'] = text.split('@', 1)[-1].strip()
+        elif ' - ' in text:
+            m = LOG_USAGE.search(text)
+            if m:
+                g = [int(x) for x in m.groups()[:8]]
+                event.setdefault('usage', {})[m.group(9)] = (
+                    g[0] * 86400 + g[1] * 3600 + g[2] * 60 + g[3] +
+                    g[4] * 86400 + g[5] * 3600 + g[6] * 60 + g[7])
+                continue
+            m = LOG_VALUE.match(text)
+            if m:
+                event.setdefault('values', {})[m.group(2)] = float(m.group(1))
+        elif ':' in text:
+            m = LOG_RESOURCE.match(text)
+            if m:
+                event.setdefault('resources', {})[m.group(1)] = tuple(
+                    [float(x) for x in m.group(3, 4, 5)])
+        elif 'termination' in text:
+            m = LOG_RETURN.search(text)
+            if m:
+                key = 'return_value' if 'return value' in text else 'signal'
+                event[key] = int(m.group(1))
+    return event
+
+def job_runs(logs):
+    """
+    Combine the events in user logs into one record per job (cluster
+    process) submitted, yielded when the job finishes, in a single pass.
+    Each record is a dict with:
+      node, cluster, proc, host, status ('ok', 'failed', 'aborted', or
+      'incomplete' at the end of the log), submitted, started (first
+      execution), executed (last execution), ended, queue_wait, run_time,
+      transfer_in, transfer_out (seconds, or None), memory (peak MB),
+      cpus (average cpus used), cpu_seconds, disk (KB), requests ({'memory':
+      MB, 'cpus': n, 'disk': KB}), held and evicted (counts)
+    """
+    jobs = {}                  # (cluster, proc) => record
+    nodes = {}                 # cluster => node name
+    def finish(job, status, end):
+        job['status'] = status
+        job['ended'] = end
+        if job['started'] is not None:
+            job['queue_wait'] = job['started'] - job['submitted']
+        if job['executed'] is not None and end is not None:
+            job['run_time'] = end - job['executed']
+            if job['cpus'] is None and job['cpu_seconds'] is not None and job['run_time']:
+                job['cpus'] = job['cpu_seconds'] / job['run_time']
+        return job
+    for e in read_user_log(logs):
+        key = (e['cluster'], e['proc'])
+        code = e['code']
+        if code == 0:
+            if 'node' in e:
+                nodes[e['cluster']] = e['node']
+            jobs[key] = {
+                'node': nodes.get(e['cluster']), 'cluster': e['cluster'],
+                'proc': e['proc'], 'host': None, 'status': None,
+                'submitted': e['time'], 'started': None, 'executed': None,
+                'ended': None, 'queue_wait': None, 'run_time': None,
+                'transfer_in': None, 'transfer_out': None, 'memory': None,
+                'cpus': None, 'cpu_seconds': None, 'disk': None,
+                'requests': {}, 'held': 0, 'evicted': 0, 'transfer_start': None}
+            continue
+        job = jobs.get(key)
+        if job is None:
+            continue
+        if code == 1:
+            job['host'] = e.get('host', job['host'])
+            job['executed'] = e['time']
+            if job['started'] is None:
+                job['started'] = e['time']
+        elif code == 6:
+            values = e.get('values', {})
+            memory = values.get('MemoryUsage of job (MB)')
+            if memory is None and 'ResidentSetSize of job (KB)' in values:
+                memory = values['ResidentSetSize of job (KB)'] / 1024.0
+            if memory is not None:
+                job['memory'] = max(job['memory'] or 0, memory)
+        elif code == 40:
+            if e['text'].startswith('Started'):
+                job['transfer_start'] = e['time']
+            elif e['text'].startswith('Finished') and job['transfer_start'] is not None:
+                which = 'transfer_in' if 'input' in e['text'] else 'transfer_out'
+                job[which] = (job[which] or 0) + e['time'] - job['transfer_start']
+                job['transfer_start'] = None
+        elif code == 4:
+            job['evicted'] += 1
+        elif code == 12:
+            job['held'] += 1
+        elif code in (5, 9):
+            for (name, (usage, request, allocated)) in e.get('resources', {}).items():
+                name = name.lower()
+                if name in ('memory', 'cpus', 'disk'):
+                    job['requests'][name] = request
+                    if name == 'memory':
+                        job['memory'] = max(job['memory'] or 0, usage)
+                    else:
+                        job[name] = usage
+            usage = e.get('usage', {})
+            if 'Run Remote Usage' in usage:
+                job['cpu_seconds'] = usage['Run Remote Usage']
+            del jobs[key]
+            if code == 9:
+                yield finish(job, 'aborted', e['time'])
+            else:
+                ok = e.get('return_value') == 0
+                yield finish(job, 'ok' if ok else 'failed', e['time'])
+    for job in jobs.values():
+        yield finish(job, 'incomplete', None)
+
+def node_function(id):
+    """Return the function name part of a node id, e.g. "adder" for "adder_12" """
+    return re.sub(r'_?\d+$', '', id)
+
+def nearest_rank(values, p):
+    """Return the p'th percentile of some values (nearest rank)"""
+    values = sorted(values)
+    return values[max(0, min(len(values), -(-len(values) * p // 100)) - 1)]
+
+# (var, field of job_runs() records, units, whether to add headroom);
+# cpus are rounded rather than padded, since the jobs of a single
+# threaded function use a little under one cpu
+TUNED_RESOURCES = [
+    ('request_memory', 'memory', 'MB', True),
+    ('request_cpus', 'cpus', '', False),
+    ('request_disk', 'disk', 'KB', True),
+]
+
+def function_usage(runs, percentile=95):
+    """
+    Summarise the records of job_runs() by function. Returns {function:
+    {field: (value at the given percentile, number of jobs)}} for the
+    memory, cpus and disk used and the run_time (wall-clock seconds), plus
+    'requests': what its latest jobs requested. Jobs which did not finish
+    still count, so a function whose jobs were held for using too much
+    memory is given more.
+    """
+    values = {}              # function => {field: [values]}
+    usage = {}
+    for run in runs:
+        if run['node'] is None:
+            continue
+        func = node_function(run['node'])
+        fields = values.setdefault(func, {})
+        for field in ('memory', 'cpus', 'disk', 'run_time'):
+            if run[field] is not None:
+                fields.setdefault(field, []).append(run[field])
+        usage.setdefault(func, {'requests': {}})['requests'].update(run['requests'])
+    for (func, fields) in values.items():
+        for (field, v) in fields.items():
+            usage[func][field] = (nearest_rank(v, percentile), len(v))
+    return usage
+
+def recommend_resources(usage, headroom=0.2):
+    """
+    Suggest request_memory, request_cpus and request_disk for each function
+    from its function_usage(): what its jobs used, plus headroom (a
+    fraction) for memory and disk. Returns {function: {var: value}}.
+    """
+    import math
+    hints = {}
+    for (func, fields) in usage.items():
+        for (var, field, units, pad) in TUNED_RESOURCES:
+            if field not in fields:
+                continue
+            used = fields[field][0]
+            if pad:
+                value = int(math.ceil(used * (1 + headroom)))
+            else:
+                value = int(round(used))
+            hints.setdefault(func, {})[var] = max(1, value)
+    return hints
+
+############################################################
+#
+# Reporting on a finished run
+#
+############################################################
+
+# e.g. "01/31/24 10:00:00 Retrying node adder_1 (retry #1 of 3)..."
+DAGMAN_RETRY = re.compile(r'Retrying node (\S+) \(retry #(\d+)')
+# Written to stderr by autorun() and worker_main()
+RUNNING_ON = re.compile(r'^HTCONDOR: Running on ([^\s,]+)')
+
+class RunReport(object):
+    """
+    The result of run_report():
+      nodes                - {node: dict} with cluster, submits, retries,
+                             status, submitted, started, ended, queue_wait,
+                             run_time, transfer (seconds) and host, for the
+                             node's last attempt (over all its processes)
+      critical_path        - the chain of nodes which held up the end of
+                             the run: the node which finished last, the
+                             parent of it which finished last, and so on
+      critical_path_length - seconds from its first submit to its end
+      profile              - [(time, number of jobs running)] at each change
+      hosts                - {host: [jobs, total run time]}
+      start, end           - times of the first submit and the last end
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.critical_path = []
+        self.critical_path_length = 0.0
+        self.profile = []
+        self.hosts = {}
+        self.start = None
+        self.end = None
+
+    def __repr__(self):
+        return "RunReport(nodes=%d,critical_path_length=%s)" % (
+            len(self.nodes), self.critical_path_length)
+
+    def slowest_hosts(self, limit=None):
+        """Return [(host, jobs, mean run time, total)], slowest first"""
+        rows = [(host, n, total / n, total)
+                for (host, (n, total)) in self.hosts.items()]
+        return sorted(rows, key=lambda r: -r[2])[:limit]
+
+    def utilization(self, buckets=20):
+        """
+        Return [(start time, mean number of jobs running)] for equal
+        intervals of the run
+        """
+        if len(self.profile) < 2:
+            return []
+        (first, last) = (self.profile[0][0], self.profile[-1][0])
+        width = float(last - first) / buckets or 1.0
+        busy = [0.0] * buckets
+        for ((t, running), (t2, _)) in zip(self.profile, self.profile[1:]):
+            while running and t < t2:
+                b = min(int((t - first) / width), buckets - 1)
+                step = min(t2, first + (b + 1) * width) - t
+                if step <= 0:
+                    step = t2 - t
+                busy[b] += running * step
+                t += step
+        return [(first + b * width, busy[b] / width) for b in range(buckets)]
+
+    def print_report(self, file=sys.stdout, limit=20, buckets=20):
+        """Print a summary, the critical path, the slowest nodes and hosts,
+           and the utilization over time"""
+        nodes = self.nodes
+        print("%d nodes, %d retries, %d not ok, %.0fs from first submit to last end" % (
+            len(nodes), sum([n['retries'] for n in nodes.values()]),
+            len([n for n in nodes.values() if n['status'] != 'ok']),
+            (self.end or 0) - (self.start or 0)), file=file)
+        header = "%-30s %-10s %7s %9s %9s %9s  %s" % (
+            "node", "status", "retries", "queue", "run", "transfer", "host")
+        def row(name):
+            n = nodes[name]
+            return "%-30s %-10s %7d %9s %9s %9s  %s" % (
+                name, n['status'], n['retries'],
+                "-" if n['queue_wait'] is None else "%.0f" % n['queue_wait'],
+                "-" if n['run_time'] is None else "%.0f" % n['run_time'],
+                "-" if n['transfer'] is None else "%.0f" % n['transfer'],
+                n['host'] or "-")
+        print("\nCritical path (%.0fs):\n%s" % (self.critical_path_length, header),
+              file=file)
+        for name in self.critical_path:
+            print(row(name), file=file)
+        print("\nSlowest nodes:\n%s" % header, file=file)
+        slowest = sorted(nodes, key=lambda n: -(nodes[n]['run_time'] or 0))
+        for name in slowest[:limit]:
+            print(row(name), file=file)
+        print("\n%-20s %6s %10s %10s" % ("host", "jobs", "mean", "total"), file=file)
+        for (host, n, mean, total) in self.slowest_hosts(limit):
+            print("%-20s %6d %10.1f %10.0f" % (host, n, mean, total), file=file)
+        print("\n%10s %8s" % ("time", "running"), file=file)
+        for (t, running) in self.utilization(buckets):
+            print("%10.0f %8.1f" % (t - self.profile[0][0], running), file=file)
+
+def run_report(dagfile, logs=None, dagman_out=None, err_files=True):
+    """
+    Read a DAG file and the logs of a run of it, and return a RunReport.
+    logs is the nodes log (default dagfile + ".nodes.log"), or a list of
+    logs. dagman_out (default dagfile + ".dagman.out", if present) gives
+    the retries of nodes. If err_files is true, the host of each job is
+    taken from the "HTCONDOR: Running on" line which autorun writes to its
+    stderr file, where there is one, rather than from the log.
+
+    Each file is read once, a line at a time, and only a record per node
+    is kept, so this copes with the logs of very large DAGs.
+    """
+    directory = os.path.dirname(dagfile)
+    parents = {}              # node => [parent nodes]
+    errors = {}               # node => stderr filename
+    with open(dagfile) as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == 'PARENT' and 'CHILD' in words:
+                i = words.index('CHILD')
+                for child in words[i+1:]:
+                    parents.setdefault(child, []).extend(words[1:i])
+            elif words[0] == 'VARS' and err_files:
+                m = re.search(r'\berror="([^"]*)"', line)
+                if m:
+                    errors[words[1]] = m.group(1)
+
+    retries = {}
+    if dagman_out is None and os.path.exists(dagfile + '.dagman.out'):
+        dagman_out = dagfile + '.dagman.out'
+    if dagman_out:
+        with open(dagman_out) as f:
+            for line in f:
+                if 'Retrying node' in line:
+                    m = DAGMAN_RETRY.search(line)
+                    if m:
+                        retries[m.group(1)] = max(retries.get(m.group(1), 0),
+                                                  int(m.group(2)))
+
+    def running_on(name, procid):
+        filename = os.path.join(directory, expand_filename(errors[name], name, procid))
+        try:
+            with open(filename) as f:
+                for line in f:
+                    m = RUNNING_ON.match(line)
+                    if m:
+                        return m.group(1)
+        except IOError:
+            pass
+
+    report = RunReport()
+    nodes = report.nodes
+    deltas = {}               # second => change in number of jobs running
+    for run in job_runs(logs or dagfile + '.nodes.log'):
+        name = run['node']
+        if name is None:
+            continue
+        node = nodes.get(name)
+        if node is None or run['cluster'] > node['cluster']:
+            # A new attempt (or the first)
+            node = nodes[name] = {
+                'cluster': run['cluster'],
+                'submits': (node['submits'] if node else 0) + 1,
+                'status': 'ok', 'submitted': run['submitted'], 'started': None,
+                'ended': None, 'queue_wait': None, 'run_time': None,
+                'transfer': None, 'host': None}
+        elif run['cluster'] < node['cluster']:
+            continue
+        if run['status'] != 'ok':
+            node['status'] = run['status']
+        host = run['host']
+        if name in errors and run['executed'] is not None:
+            host = running_on(name, run['proc']) or host
+        if run['started'] is not None:
+            node['started'] = min(node['started'] or run['started'], run['started'])
+        if run['ended'] is not None:
+            node['ended'] = max(node['ended'] or run['ended'], run['ended'])
+        if run['run_time'] is not None:
+            # Every run counts towards its host; the node keeps its longest
+            stats = report.hosts.setdefault(host or 'unknown', [0, 0.0])
+            stats[0] += 1
+            stats[1] += run['run_time']
+            if run['run_time'] >= (node['run_time'] or 0):
+                node['run_time'] = run['run_time']
+                node['host'] = host
+        if run['transfer_in'] is not None or run['transfer_out'] is not None:
+            node['transfer'] = max(node['transfer'] or 0, (run['transfer_in'] or 0) +
+                                   (run['transfer_out'] or 0))
+        if run['executed'] is not None:
+            t = int(run['executed'])
+            deltas[t] = deltas.get(t, 0) + 1
+            if run['ended'] is not None:
+                t = int(run['ended'])
+                deltas[t] = deltas.get(t, 0) - 1
+        report.start = min(report.start or run['submitted'], run['submitted'])
+        if run['ended'] is not None:
+            report.end = max(report.end or run['ended'], run['ended'])
+
+    running = 0
+    for t in sorted(deltas):
+        running += deltas[t]
+        report.profile.append((t, running))
+    for (name, node) in nodes.items():
+        if node['started'] is not None:
+            node['queue_wait'] = node['started'] - node['submitted']
+        node['retries'] = max(node['submits'] - 1, retries.get(name, 0))
+
+    # The realized critical path: follow the parent which finished last
+    finished = [(node['ended'], name) for (name, node) in nodes.items()
+                if node['ended'] is not None]
+    name = max(finished)[1] if finished else None
+    while name is not None:
+        report.critical_path.append(name)
+        done = [(nodes[p]['ended'], p) for p in parents.get(name, ())
+                if p in nodes and nodes[p]['ended'] is not None]
+        name = max(done)[1] if done else None
+    report.critical_path.reverse()
+    if report.critical_path:
+        report.critical_path_length = (nodes[report.critical_path[-1]]['ended'] -
+                                       nodes[report.critical_path[0]]['submitted'])
+    return report
+
+############################################################
+#
+# Worker entry point
+#
+############################################################
+
+worker_script = None   # generator script, when running under worker_main()
+startup_seconds = None # time from process start to running the job
+
+class StopScript(Exception):
+    """Raised by autorun() to stop a script loaded by worker_main()"""
+
+class MainModule(types.ModuleType):
+    """
+    Stands in for the generator script as __main__ in worker_main(). The
+    script is only run, up to its autorun() call, the first time one of
+    its names is needed: e.g. to unpickle a function defined in it.
+    """
+    def __init__(self, script):
+        super(MainModule, self).__init__('__main__')
+        self.__file__ = script
+
+    def __getattr__(self, name):
+        if name.startswith('__') or self.__dict__.get('_loaded'):
+            raise AttributeError(name)
+        self._loaded = True
+        with open(self.__file__) as f:
+            code = compile(f.read(), self.__file__, 'exec')
+        try:
+            exec(code, self.__dict__)
+        except StopScript:
+            pass
+        return getattr(self, name)
+
+def process_age():
+    """Return the seconds since this process started, or None if unknown"""
+    try:
+        with open('/proc/self/stat') as f:
+            start = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return uptime - start / os.sysconf('SC_CLK_TCK')
+
+def worker_main(argv=None):
+    """
+    Run a job of a Dag(worker=True). Arguments are the generator script's
+    filename and [--compression=codec] [--stats[=dir]] [--output-none]
+    [--tune] [--quiet]. Only the modules which define the job's function and
+    arguments are imported; the script itself is only run if they were
+    defined in it. Reports the time taken to start up on stderr.
+    """
+    global worker_script, startup_seconds
+    if argv is None:
+        argv = sys.argv[1:]
+    options = {}
+    quiet = False
+    for arg in argv:
+        if arg.startswith('--compression='):
+            options['compression'] = arg.split('=', 1)[1]
+        elif arg == '--stats':
+            options['stats'] = True
+        elif arg.startswith('--stats='):
+            options['stats'] = arg.split('=', 1)[1]
+        elif arg == '--output-none':
+            options['output_none'] = True
+        elif arg == '--tune':
+            options['tune'] = True
+        elif arg == '--quiet':
+            quiet = True
+        else:
+            worker_script = local_file(arg)
+    if worker_script is not None:
+        sys.modules['__main__'] = MainModule(worker_script)
+    startup_seconds = process_age()
+    if not quiet:
+        import socket
+        print("HTCONDOR: Running on %s, worker startup %s" % (
+            socket.gethostname(), "%.3fs" % startup_seconds
+            if startup_seconds is not None else "unknown"), file=sys.stderr)
+    run(**options)
+    return 0
+
+# Jobs of a Dag(worker=True) run this file as the executable. Note that it
+# is renamed to "condor_exec.exe", so the job runs the copy of
+# htcondor_dag.py which is transferred alongside it, and other modules
+# which import htcondor_dag share that copy.
 if __name__ == '__main__':
-    run()
-    sys.exit(0)
+    import htcondor_dag
+    sys.exit(htcondor_dag.worker_main())
 
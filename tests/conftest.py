@@ -12,6 +12,16 @@ import __builtin__
 def dag():
     return htcondor_dag.Dag("test")
 
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    """Run the test in its own temporary directory"""
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+class MockFile(StringIO.StringIO):
+    def __enter__(self): return self
+    def __exit__(self, *args): self.close()
+
 class MockFS(object):
     def __init__(self):
         self.files = {}
@@ -30,7 +40,7 @@ class MockFS(object):
             nf.__exit__ = __exit__
             self.files[filename] = nf
             return nf
-        return StringIO.StringIO(self.files[filename])
+        return MockFile(self.files[filename])
 
     def __getitem__(self, key):
         return self.files[key]
@@ -40,3 +50,14 @@ def mockfs(monkeypatch):
     fs = MockFS()
     monkeypatch.setattr(__builtin__, "open", fs.open)
     return fs
+
+@pytest.fixture
+def jobad(monkeypatch):
+    """
+    Pretend to be running as a htcondor job. Returns the job ad as a dict
+    which the test can fill in (e.g. DAGNodeName, ProcId)
+    """
+    ad = {}
+    monkeypatch.setenv('_CONDOR_JOB_AD', '.job.ad')
+    monkeypatch.setattr(htcondor_dag, "ads", {'_CONDOR_JOB_AD': ad})
+    return ad
@@ -22,3 +22,26 @@ def test_simple_jobs(dag):
     assert [x.submit for x in dag.nodes] == ['foo.sub', 'xyz.sub']
     assert 'request_memory' not in dag.nodes[0].vars
     assert dag.nodes[1].vars['request_memory'] == 123
+
+def test_compact_nodes(dag):
+    j0 = dag.job(id_prefix="foo_")
+    j1 = dag.job(id_prefix="foo_")
+    j2 = dag.job("bar")
+    assert not hasattr(j0, '__dict__')
+    assert (j0.prefix, j0.seq) == ("foo_", 0)
+    assert [x.id for x in dag.nodes] == ['foo_0', 'foo_1', 'bar']
+    assert [dag.node_id(i) for i in range(3)] == ['foo_0', 'foo_1', 'bar']
+
+    # dependencies are kept by the dag, and seen from both ends
+    j2.parent(j0, j1)
+    j0.child(j2)
+    assert j2.parents == set([j0, j1])
+    assert j0.children == set([j2])
+    assert j1.children == set([j2])
+    assert dag.parent_lists[j0.index] is None
+
+    # nodes outside the dag keep their own dependencies
+    other = htcondor_dag.Job("other")
+    other.parent(j1)
+    assert other.parents == set([j1])
+    assert j1.children == set([j2, other])
@@ -0,0 +1,114 @@
+import os
+import pytest
+import htcondor_dag
+from htcondor_dag import procid, lazy
+
+numpy = pytest.importorskip("numpy")
+
+def make(n, scale=1):
+    return {"big": numpy.arange(n, dtype="float64") * scale,
+            "small": numpy.arange(3), "matrix": numpy.ones((300, 200), order="F"),
+            "empty": numpy.zeros((0, 5))}
+
+def total(value):
+    assert isinstance(value["big"], numpy.memmap)
+    assert not value["big"].flags.writeable
+    assert not isinstance(value["small"], numpy.memmap)
+    assert value["matrix"].shape == (300, 200)
+    assert value["empty"].shape == (0, 5)
+    return float(value["big"].sum() + value["matrix"].sum())
+
+def cluster_total(values):
+    return sum([float(v["big"].sum()) for v in values])
+
+def test_buffers_option(dag):
+    j1 = dag.defer(make, buffers=1000)(200000)
+    j2 = dag.defer(make, buffers=True, processes=3)(10, procid)
+    j3 = dag.defer(total)(j1)
+    j4 = dag.defer(cluster_total)(j2)
+    assert dag.input.data["make_0"][3] == {"buffers": (1000, "test.make_0.out.buf")}
+    assert dag.input.data["make_1"][3] == {
+        "buffers": (htcondor_dag.BUFFER_MIN_BYTES, "test.make_1.out.$(process).buf")}
+    assert j3['input_files'] == "test.make_0.out,test.make_0.out.buf"
+    assert "test.make_1.out.2.buf" in j4['input_files'].split(",")
+    j1.var(output="other.out")
+    assert dag.input.data["make_0"][3]["buffers"][1] == "other.out.buf"
+    j1.var(output=None)
+    assert len(dag.input.data["make_0"]) == 3
+
+def test_buffers_run(workdir):
+    dag = htcondor_dag.Dag("test")
+    j1 = dag.defer(make, buffers=1000)(200000)
+    j2 = dag.defer(make, buffers=1000, processes=2)(50000, procid)
+    j3 = dag.defer(total)(j1)
+    j4 = dag.defer(cluster_total, lazy=True)(j2)
+    dag.run_local(workers=2, compression="zlib")
+    # The arrays are not in the pickle
+    assert os.path.getsize("test.make_0.out") < 10000
+    assert os.path.getsize("test.make_0.out.buf") >= 200000 * 8 + 300 * 200 * 8
+    assert htcondor_dag.load_value(open("test.total_0.out", "rb")) == \
+        sum(range(200000)) + 300 * 200
+    assert htcondor_dag.load_value(open("test.cluster_total_0.out", "rb")) == \
+        sum(range(50000))
+    value = htcondor_dag.load_value(open("test.make_0.out", "rb"), "test.make_0.out.buf")
+    assert (value["matrix"] == 1).all() and value["big"][-1] == 199999
+
+def nothing(n):
+    return None
+
+def test_buffers_run_eager(workdir):
+    dag = htcondor_dag.Dag("test")
+    j1 = dag.defer(make, buffers=1000, processes=2)(50000, procid)
+    j2 = dag.defer(cluster_total)(j1)
+    j3 = dag.defer(nothing, buffers=True)(1)
+    dag.run_local(workers=2)
+    assert htcondor_dag.load_value(open("test.cluster_total_0.out", "rb")) == \
+        sum(range(50000))
+    # A job which returns None still leaves a sidecar for its consumers
+    assert os.path.getsize("test.nothing_0.out.buf") == 0
+
+def test_buffers_cache(workdir, monkeypatch):
+    def build():
+        dag = htcondor_dag.Dag("test", cache_dir="cache")
+        j1 = dag.defer(make, buffers=1000)(200000)
+        j2 = dag.defer(make, buffers=1000, processes=2)(50000, procid)
+        j3 = dag.defer(total)(j1)
+        return (dag, j1, j2, j3)
+    (dag, j1, j2, j3) = build()
+    sidecar = "cache/%s.out.buf" % j1.cache_key
+    assert sidecar in j3['input_files'].split(",")
+    dag.write()
+    text = open("test.dag").read()
+    # htcondor brings the sidecar back into the cache, like the output
+    assert 'transfer_output_remaps="\\"%s.out.buf=%s\\""' % (
+        j1.cache_key, sidecar) in text
+    assert 'transfer_output_remaps="\\"%s.out.$(process).buf=cache/%s.out.$(process).buf\\""' % (
+        j2.cache_key, j2.cache_key) in text
+    assert "transfer_output_remaps" not in text.split("JOB total_0")[1]
+
+    # On an execute node there is no cache directory
+    monkeypatch.setenv("_CONDOR_JOB_AD", "")
+    monkeypatch.setattr(htcondor_dag, "ads", {})
+    with workdir.mkdir("scratch").as_cwd():
+        (_, _, _, error) = htcondor_dag.run_local_process(
+            "make_0", os.path.abspath("../test.in"), "out", 0, {})
+    assert error is None
+    assert os.path.exists("scratch/%s.out.buf" % j1.cache_key)
+    monkeypatch.delenv("_CONDOR_JOB_AD")
+
+    dag.run_local(workers=2)
+    assert os.path.exists(sidecar)
+    assert htcondor_dag.load_value(open("test.total_0.out", "rb")) == \
+        sum(range(200000)) + 300 * 200
+    (dag, j1, j2, j3) = build()
+    dag.write()
+    assert [j.done for j in (j1, j2, j3)] == [True, True, True]
+    os.unlink(sidecar)
+    (dag, j1, j2, j3) = build()
+    dag.write()
+    assert [j.done for j in (j1, j2, j3)] == [False, True, False]
+
+def test_read_output_without_sidecar(workdir):
+    with open("plain.out", "wb") as f:
+        f.write(htcondor_dag.pickle.dumps([1, 2], 2))
+    assert htcondor_dag.read_output("plain.out") == [1, 2]
@@ -0,0 +1,109 @@
+import os
+import htcondor_dag
+from htcondor_dag import procid
+
+def adder(a, b): return a + b
+def combine(values, x): return values + [x]
+
+def build(a=1, b=3):
+    dag = htcondor_dag.Dag("test", cache_dir="cache")
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(adder)(j1, b)
+    j3 = dag.defer(adder, processes=2)(procid, a)
+    j4 = dag.defer(combine, output="plain.out")(j3, j2)
+    return (dag, j1, j2, j3, j4)
+
+def test_cache(workdir):
+    (dag, j1, j2, j3, j4) = build()
+    assert j1.cache_key is not None
+    assert j1['output'] == os.path.join("cache", j1.cache_key + ".out")
+    assert j2['input_files'] == j1['output']
+    assert j4.cache_key is None
+    dag.write()
+    assert os.readlink("test.adder_0.out") == j1['output']
+    assert os.readlink("test.adder_2.out.1") == "cache/" + j3.cache_key + ".out.1"
+    assert " DONE" not in open("test.dag").read()
+    dag.run_local(workers=2)
+    assert htcondor_dag.load_value(open("test.adder_1.out", "rb")) == 6
+
+    # Nothing has changed, so all cached jobs are done
+    os.unlink("test.in")
+    (dag, j1, j2, j3, j4) = build()
+    dag.write()
+    assert [j.done for j in (j1, j2, j3, j4)] == [True, True, True, False]
+    assert "JOB adder_0 test.sub DONE" in open("test.dag").read()
+    assert not os.path.exists("test.in")
+    assert dag.run_local(workers=2)["combine_0"] >= 0
+    assert htcondor_dag.load_value(open("plain.out", "rb")) == [1, 2, 6]
+
+    # Only jobs which depend on a changed argument are rerun
+    (dag, j1, j2, j3, j4) = build(b=4)
+    dag.write()
+    assert [j.done for j in (j1, j2, j3, j4)] == [True, False, True, False]
+    assert not os.path.exists("test.in")
+    assert htcondor_dag.read_input(open("test.adder_1.in", "rb")).keys() == ["adder_1"]
+    assert not os.path.exists(j2['output'])
+
+def test_cache_parent_not_done(workdir):
+    (dag, j1, j2, j3, j4) = build()
+    dag.write()
+    dag.run_local(workers=2)
+    os.unlink(j1['output'])
+
+    (dag, j1, j2, j3, j4) = build()
+    dag.write()
+    assert [j.done for j in (j1, j2, j3, j4)] == [False, False, True, False]
+
+def test_cache_key_function_code(dag):
+    def f(a): return a + 1
+    k1 = htcondor_dag.function_identity(f)
+    def f(a): return a + 2
+    assert htcondor_dag.function_identity(f) != k1
+
+def test_valid_output(workdir):
+    import pickle
+    open("empty", "wb").close()
+    assert not htcondor_dag.valid_output("empty")
+    assert not htcondor_dag.valid_output("missing")
+    with open("good", "wb") as f:
+        pickle.dump([1, 2], f, 2)
+    assert htcondor_dag.valid_output("good")
+    with open("bad", "wb") as f:
+        f.write(pickle.dumps([1, 2], 2)[:-1])
+    assert not htcondor_dag.valid_output("bad")
+    data = htcondor_dag.compress(pickle.dumps([1, 2], 2), "zlib")
+    with open("good.z", "wb") as f:
+        f.write(data)
+    assert htcondor_dag.valid_output("good.z")
+    with open("bad.z", "wb") as f:
+        f.write(data[:-3])
+    assert not htcondor_dag.valid_output("bad.z")
+
+def nothing(a): return None
+
+def test_cache_none(workdir):
+    dag = htcondor_dag.Dag("test", cache_dir="cache")
+    j1 = dag.defer(nothing)(1)
+    dag.write()
+    dag.run_local(workers=1)
+    assert htcondor_dag.load_value(open(j1['output'], "rb")) is None
+
+    dag = htcondor_dag.Dag("test", cache_dir="cache")
+    j1 = dag.defer(nothing)(1)
+    dag.write()
+    assert j1.done
+
+def test_cache_key_defaults_and_closure(dag):
+    def f(a, b=1): return a + b
+    k1 = htcondor_dag.function_identity(f)
+    def f(a, b=2): return a + b
+    assert htcondor_dag.function_identity(f) != k1
+
+    def make(n):
+        def g(a): return a + n
+        return g
+    assert dag.cache_key(make(1), (1,), {}) == dag.cache_key(make(1), (1,), {})
+    assert dag.cache_key(make(1), (1,), {}) != dag.cache_key(make(2), (1,), {})
+
+    def fact(n): return n * fact(n - 1) if n else 1
+    assert dag.cache_key(fact, (3,), {}) is not None
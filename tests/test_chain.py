@@ -1,7 +1,3 @@
-try:
-    import cPickle as pickle
-except:
-    import pickle
 import htcondor_dag
 
 def adder(a,b): return a+b
@@ -35,13 +31,13 @@ VARS print_sum_0 error="test.print_sum_0.err" input="test.print_sum_0.in" input_
 PARENT adder_0 adder_1 CHILD print_sum_0
 """
 
-    args = pickle.loads(mockfs["test.in"])
+    args = htcondor_dag.read_input(open("test.in", "rb"))
     assert args == {
         "adder_0": (adder, (1,2), {}),
         "adder_1": (adder, (3,4), {}),
     }
 
-    args = pickle.loads(mockfs["test.print_sum_0.in"])
+    args = htcondor_dag.read_input(open("test.print_sum_0.in", "rb"))
     assert args["print_sum_0"][0] == print_sum
     assert isinstance(args["print_sum_0"][1][0], htcondor_dag.Job)
     assert isinstance(args["print_sum_0"][1][1], htcondor_dag.Job)
@@ -0,0 +1,61 @@
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import StringIO
+import pytest
+import htcondor_dag
+
+def adder(a,b): return a+b
+
+CODECS = [None, 'zlib', 'gzip', 'bz2']
+try:
+    import lzma
+    CODECS.append('lzma')
+except ImportError:
+    pass
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_roundtrip(codec):
+    data = pickle.dumps(range(1000), 2)
+    packed = htcondor_dag.compress(data, codec)
+    assert htcondor_dag.codec_of(packed) == codec
+    assert htcondor_dag.decompress(packed) == data
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        htcondor_dag.compress("abc", "rot13")
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_compressed_input(mockfs, codec):
+    dag = htcondor_dag.Dag("test", compression=codec)
+    dag.defer(adder)(1, 2)
+    dag.defer(adder)(3, 4)
+    dag.write()
+
+    assert htcondor_dag.read_input(open("test.in", "rb"), "adder_1") == \
+        (adder, (3,4), {})
+    assert htcondor_dag.read_input(open("test.in", "rb")) == {
+        "adder_0": (adder, (1,2), {}),
+        "adder_1": (adder, (3,4), {}),
+    }
+
+def test_compressed_output_mixed(dag, mockfs, jobad):
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(adder)(3, 4)
+    j3 = dag.defer(adder)(j1, j2)
+    dag.write()
+
+    # adder_0 writes compressed output, adder_1 writes plain
+    jobad['DAGNodeName'] = 'adder_0'
+    with open("test.adder_0.out", "wb") as f:
+        htcondor_dag.run(src=open("test.in", "rb"), dst=f, compression='zlib')
+    assert htcondor_dag.codec_of(mockfs["test.adder_0.out"]) == 'zlib'
+    jobad['DAGNodeName'] = 'adder_1'
+    with open("test.adder_1.out", "wb") as f:
+        htcondor_dag.run(src=open("test.in", "rb"), dst=f)
+
+    jobad['DAGNodeName'] = 'adder_2'
+    dst = StringIO.StringIO()
+    htcondor_dag.run(src=open("test.adder_2.in", "rb"), dst=dst)
+    assert pickle.loads(dst.getvalue()) == 10
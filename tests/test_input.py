@@ -0,0 +1,109 @@
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import StringIO
+import pytest
+import htcondor_dag
+
+def adder(a,b): return a+b
+
+def test_input_indexed(dag, mockfs):
+    dag.defer(adder)(1, 2)
+    dag.defer(adder)(3, 4)
+    dag.write()
+
+    assert mockfs["test.in"].startswith(htcondor_dag.INPUT_MAGIC)
+    assert htcondor_dag.read_input(open("test.in", "rb"), "adder_1") == \
+        (adder, (3,4), {})
+    with pytest.raises(KeyError):
+        htcondor_dag.read_input(open("test.in", "rb"), "adder_2")
+
+class CountingFile(object):
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+    def read(self, *args):
+        data = self.f.read(*args)
+        self.bytes_read += len(data)
+        return data
+    def seek(self, *args):
+        return self.f.seek(*args)
+    def tell(self):
+        return self.f.tell()
+
+def test_input_binary_search(dag, mockfs):
+    for i in range(2000):
+        dag.defer(adder)(i, i)
+    dag.write()
+
+    f = CountingFile(open("test.in", "rb"))
+    assert htcondor_dag.read_input(f, "adder_1234") == (adder, (1234, 1234), {})
+    # Only a few index entries are read, not the whole index
+    assert f.bytes_read < 1000 < len(mockfs["test.in"]) // 50
+    with pytest.raises(KeyError):
+        htcondor_dag.read_input(open("test.in", "rb"), "adder_2000")
+    data = htcondor_dag.read_input(open("test.in", "rb"))
+    assert len(data) == 2000 and data["adder_7"] == (adder, (7, 7), {})
+
+def test_input_legacy():
+    data = {"adder_0": (adder, (1,2), {})}
+    f = StringIO.StringIO(pickle.dumps(data, 2))
+    assert htcondor_dag.read_input(f) == data
+    f = StringIO.StringIO(pickle.dumps(data, 2))
+    assert htcondor_dag.read_input(f, "adder_0") == (adder, (1,2), {})
+
+def test_run_reads_own_record(dag, mockfs, jobad):
+    dag.defer(adder)(1, 2)
+    dag.defer(adder)(3, 4)
+    dag.write()
+
+    jobad['DAGNodeName'] = 'adder_1'
+    dst = StringIO.StringIO()
+    htcondor_dag.run(src=open("test.in", "rb"), dst=dst)
+    assert pickle.loads(dst.getvalue()) == 7
+
+    jobad['DAGNodeName'] = 'adder_9'
+    with pytest.raises(KeyError):
+        htcondor_dag.run(src=open("test.in", "rb"), dst=dst)
+
+def test_shard_jobs(mockfs):
+    dag = htcondor_dag.Dag("test", shard_jobs=2)
+    jobs = [dag.defer(adder)(i, i) for i in range(5)]
+    dag.write()
+
+    assert [str(j['input']) for j in jobs] == \
+        ["test.0.in", "test.0.in", "test.1.in", "test.1.in", "test.2.in"]
+    assert "test.in" not in mockfs.files
+    assert sorted(htcondor_dag.read_input(open("test.1.in", "rb")).keys()) == \
+        ["adder_2", "adder_3"]
+    assert 'VARS adder_4 error="test.adder_4.err" input="test.2.in"' in \
+        mockfs["test.dag"]
+
+def test_shard_bytes(mockfs):
+    dag = htcondor_dag.Dag("test", shard_bytes=1000)
+    jobs = [dag.defer(adder)("x" * 600, i) for i in range(4)]
+    dag.write()
+
+    assert [str(j['input']) for j in jobs] == \
+        ["test.0.in", "test.0.in", "test.1.in", "test.1.in"]
+    assert htcondor_dag.read_input(open("test.1.in", "rb"), "adder_3") == \
+        (adder, ("x" * 600, 3), {})
+
+def test_shard_bytes_pickles_once(mockfs, monkeypatch):
+    dumps = []
+    real_dumps = htcondor_dag.pickle.dumps
+    def counting_dumps(value, *args):
+        dumps.append(value)
+        return real_dumps(value, *args)
+    monkeypatch.setattr(htcondor_dag.pickle, "dumps", counting_dumps)
+    dag = htcondor_dag.Dag("test", shard_bytes=1000)
+    jobs = [dag.defer(adder)("x" * 600, i) for i in range(4)]
+    # Only the pickle of each record is kept
+    assert jobs[1]['input'].data["adder_1"] is None
+    jobs[1].var(profile="cpu")
+    assert jobs[1]['input'].record("adder_1")[3] == {"profile": "cpu"}
+    dag.write()
+    assert len(dumps) == 5
+    assert htcondor_dag.read_input(open("test.0.in", "rb"), "adder_1") == \
+        (adder, ("x" * 600, 1), {}, {"profile": "cpu"})
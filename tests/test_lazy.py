@@ -0,0 +1,71 @@
+import pytest
+import htcondor_dag
+from htcondor_dag import procid, lazy, OutputSequence
+
+def adder(a, b): return a + b
+def total(values):
+    assert isinstance(values, OutputSequence)
+    assert len(values) == 4 and values[1] == 11 and values[-1] == 13
+    assert values[1:3] == [11, 12]
+    return sum(values)
+def eager_total(values):
+    assert isinstance(values, list)
+    return sum(values)
+
+def test_lazy_cluster(workdir):
+    dag = htcondor_dag.Dag("test")
+    j1 = dag.defer(adder, processes=4)(procid, 10)
+    j2 = dag.defer(total)(lazy(j1))
+    j3 = dag.defer(eager_total)(j1)
+    assert j2.parents == set([j1])
+    assert j2['input_files'] == j3['input_files']
+    dag.run_local(workers=2)
+    assert htcondor_dag.load_value(open("test.total_0.out", "rb")) == 46
+    assert htcondor_dag.load_value(open("test.eager_total_0.out", "rb")) == 46
+
+def test_lazy_unpickle(dag):
+    j1 = dag.defer(adder, processes=2)(procid, 10)
+    j2 = dag.defer(total)(lazy(j1))
+    (func, args, kwargs) = j2['input'].data["total_0"]
+    assert isinstance(args[0], htcondor_dag.Lazy)
+    again = htcondor_dag.pickle.loads(htcondor_dag.pickle.dumps(args[0]))
+    assert isinstance(again, htcondor_dag.Lazy)
+    assert again.job.id == "adder_0"
+    with pytest.raises(TypeError):
+        lazy(5)
+
+def pick(flag, a, b):
+    return a + 1 if flag else b * 2
+
+def test_lazy_value(workdir, jobad):
+    with open("a.out", "wb") as f:
+        htcondor_dag.pickle.dump([1, 2, 3], f)
+    with open("b.out", "wb") as f:
+        htcondor_dag.pickle.dump(5, f)
+    v = htcondor_dag.read_job_output("a", "a.out", None, True)
+    assert isinstance(v, htcondor_dag.LazyValue)
+    assert repr(v) == "LazyValue('a.out')"
+    assert len(v) == 3
+    assert v + [4] == [1, 2, 3, 4]
+    assert [0] + v == [0, 1, 2, 3]
+    assert v[0] == 1 and 2 in v and list(v) == [1, 2, 3]
+    n = htcondor_dag.LazyValue("b.out")
+    assert n * 2 == 10 and 2 ** n == 32 and n == 5 and n > 4
+    assert bool(n) and hash(n) == hash(5) and str(n) == "5"
+    assert htcondor_dag.resolve(n) is 5 and htcondor_dag.resolve(7) == 7
+    assert htcondor_dag.pickle.loads(htcondor_dag.pickle.dumps(n)) == 5
+    missing = htcondor_dag.LazyValue("missing.out")
+    with pytest.raises(IOError):
+        missing + 1
+
+def test_defer_lazy(workdir):
+    dag = htcondor_dag.Dag("test")
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(adder)(3, 4)
+    j3 = dag.defer(pick, lazy=True)(True, j1, b=j2)
+    (func, args, kwargs) = j3['input'].data["pick_0"]
+    assert isinstance(args[1], htcondor_dag.Lazy)
+    assert isinstance(kwargs["b"], htcondor_dag.Lazy)
+    assert j3.parents == set([j1, j2])
+    dag.run_local(workers=2)
+    assert htcondor_dag.load_value(open("test.pick_0.out", "rb")) == 4
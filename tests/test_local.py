@@ -0,0 +1,88 @@
+import os
+import time
+import pytest
+import htcondor_dag
+from htcondor_dag import procid
+
+def adder(a, b): return a + b
+def total(values): return sum(values)
+
+def exclusive(name):
+    """Fails if another job holding the same lock is running"""
+    fd = os.open(name + ".lock", os.O_CREAT | os.O_EXCL)
+    time.sleep(0.05)
+    os.close(fd)
+    os.unlink(name + ".lock")
+
+def flaky(name):
+    """Fails the first time it is called"""
+    if not os.path.exists(name):
+        open(name, "w").close()
+        raise RuntimeError("first attempt")
+    return "ok"
+
+def fail(): raise ValueError("always")
+
+def test_run_local_chain(dag, workdir):
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(adder, processes=4)(procid, 10)
+    j3 = dag.defer(adder)(j1, 100)
+    j4 = dag.defer(total)(j2)
+    j5 = dag.defer(adder, noop=True)(0, 0)
+    times = dag.run_local(workers=3)
+
+    assert sorted(times.keys()) == ["adder_0", "adder_1", "adder_2",
+                                    "adder_3", "total_0"]
+    assert all(t >= 0 for t in times.values())
+    assert htcondor_dag.load_value(open("test.adder_2.out", "rb")) == 103
+    assert htcondor_dag.load_value(open("test.total_0.out", "rb")) == 46
+
+def test_run_local_maxjobs(dag, workdir):
+    dag.maxjobs["lock"] = 1
+    for i in range(4):
+        dag.defer(exclusive, category="lock")("test")
+    times = dag.run_local(workers=4)
+    assert len(times) == 4
+
+def test_run_local_retry(dag, workdir):
+    dag.defer(flaky, retry=1)("flag")
+    j = dag.defer(adder)(1, 1)
+    dag.run_local(workers=2)
+    assert htcondor_dag.load_value(open("test.flaky_0.out", "rb")) == "ok"
+
+def test_run_local_failure(dag, workdir):
+    j1 = dag.defer(fail, retry=2)()
+    j2 = dag.defer(adder)(j1, 1)
+    j3 = dag.defer(adder)(1, 1)
+    with pytest.raises(RuntimeError) as e:
+        dag.run_local(workers=2)
+    assert "failed: fail_0;" in str(e.value)
+    assert "not run: adder_0" in str(e.value)
+    assert os.path.exists("test.adder_1.out")
+
+def nap(seconds):
+    time.sleep(seconds)
+
+def test_run_local_no_output(dag, workdir):
+    dag.defer(adder, output=None)(1, 2)
+    dag.defer(nap, processes=2)(0.2)
+    times = dag.run_local(workers=1)
+    assert not os.path.exists("test.adder_0.out")
+    # The slowest process of each job, not including waiting for a worker
+    assert 0.2 <= times["nap_0"] < 0.4
+
+def test_run_local_needs_function(dag, workdir):
+    dag.job("foo")
+    with pytest.raises(ValueError):
+        dag.run_local()
+
+def test_topological_order(dag):
+    a = dag.job("a")
+    b = dag.job("b")
+    c = dag.job("c")
+    a.parent(c)
+    c.child(b)
+    assert [n.id for n in dag.topological_order()] == ["c", "a", "b"]
+    b.child(c)
+    with pytest.raises(ValueError):
+        dag.topological_order()
@@ -0,0 +1,56 @@
+import htcondor_dag
+
+def square(x): return x * x
+def total(values): return sum(values)
+def collect(values): return values
+
+def test_map_jobs(dag):
+    group = dag.map(square, range(25), chunksize=10)
+    assert isinstance(group, htcondor_dag.JobGroup)
+    assert [j.id for j in group] == ["square_0", "square_1", "square_2"]
+    assert [len(dag.input.data[str(j)][1][1]) for j in group] == [10, 10, 5]
+    assert group[0].func is square
+    cluster = dag.map(square, range(25), chunksize=4, processes=3, id_prefix="sq")
+    assert [j.vars['processes'] for j in cluster] == [3, 3, 1]
+    consumer = dag.defer(total)(group)
+    assert consumer.parents == set(group)
+    assert consumer['input_files'] == \
+        "test.square_0.out,test.square_1.out,test.square_2.out"
+    assert dag.map(square, []) == []
+
+def test_map_run(workdir):
+    dag = htcondor_dag.Dag("test")
+    group = dag.map(square, range(25), chunksize=10)
+    cluster = dag.map(square, range(23), chunksize=4, processes=3)
+    dag.defer(collect)(group)
+    dag.defer(collect)(cluster)
+    dag.defer(total)(dag.map(square, [], chunksize=10))
+    times = dag.run_local(workers=3)
+    assert len(times) == 3 + 2 + 3
+    assert htcondor_dag.load_value(open("test.square_1.out", "rb")) == \
+        [x * x for x in range(10, 20)]
+    assert htcondor_dag.load_value(open("test.collect_0.out", "rb")) == \
+        [x * x for x in range(25)]
+    assert htcondor_dag.load_value(open("test.collect_1.out", "rb")) == \
+        [x * x for x in range(23)]
+    assert htcondor_dag.load_value(open("test.total_0.out", "rb")) == 0
+
+def test_map_cache_key(workdir):
+    dag = htcondor_dag.Dag("test", cache_dir="cache")
+    (j1,) = dag.map(square, range(5))
+    (j2,) = dag.map(total, range(5))
+    assert j1.cache_key is not None and j1.cache_key != j2.cache_key
+
+def test_map_cluster_chunks(workdir):
+    dag = htcondor_dag.Dag("test")
+    (job,) = dag.map(square, range(10), chunksize=4, processes=3)
+    (func, args, kwargs) = dag.input.data[str(job)]
+    (f, pattern, p) = args
+    assert pattern.startswith("test.") and pattern.endswith(".$(process).chunk")
+    assert job['input_files'] == pattern
+    dag.write()
+    # Each process only transfers and reads its own chunk
+    chunks = [htcondor_dag.load_value(open(pattern.replace("$(process)", str(p)), "rb"))
+              for p in range(3)]
+    assert chunks == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert len(open("test.in", "rb").read()) < 300
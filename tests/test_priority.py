@@ -0,0 +1,50 @@
+import re
+import pytest
+import htcondor_dag
+
+def slow(a): return a
+def fast(a): return a
+
+def build(**opts):
+    dag = htcondor_dag.Dag("test", **opts)
+    j = dag.defer(slow)(1)
+    j = dag.defer(slow)(j)
+    j = dag.defer(slow)(j)
+    dag.defer(fast)(1)
+    dag.defer(fast, priority=50)(2)
+    return dag
+
+def priorities(text):
+    return dict(re.findall(r'^PRIORITY (\S+) (\d+)$', text, re.MULTILINE))
+
+def test_downstream_costs():
+    dag = build()
+    assert list(dag.downstream_costs()) == [3, 2, 1, 1, 1]
+    assert list(dag.downstream_costs({"slow": 2.5})) == [7.5, 5, 2.5, 1, 1]
+    assert list(dag.downstream_costs(lambda job: len(job.id))) == [18, 12, 6, 6, 6]
+
+def test_auto_priority(mockfs):
+    dag = build()
+    dag.write()
+    assert priorities(mockfs["test.dag"]) == {"fast_1": "50"}
+
+    dag = build()
+    dag.write(auto_priority=True, cost_model={"slow": 10, "fast": 0.5})
+    assert priorities(mockfs["test.dag"]) == {
+        "slow_0": "30", "slow_1": "20", "slow_2": "10", "fast_0": "1", "fast_1": "50"}
+
+def test_auto_priority_stream(mockfs):
+    dag = build(stream=True)
+    dag.write(auto_priority=True)
+    text = mockfs["test.dag"]
+    assert priorities(text) == {
+        "slow_0": "3", "slow_1": "2", "slow_2": "1", "fast_0": "1", "fast_1": "50"}
+    # Jobs already written get their PRIORITY after their JOB line
+    assert text.index("PRIORITY slow_0") > text.index("JOB slow_0")
+
+def test_auto_priority_done(mockfs):
+    dag = htcondor_dag.Dag("test")
+    j1 = dag.job(done=True)
+    j2 = dag.job().parent(j1)
+    dag.write(auto_priority=True)
+    assert priorities(mockfs["test.dag"]) == {"1": "1"}
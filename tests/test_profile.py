@@ -0,0 +1,42 @@
+import os
+import pytest
+import htcondor_dag
+from htcondor_dag import procid
+from StringIO import StringIO
+
+def adder(a, b): return a + b
+def adder_two(a): return a + 2
+
+def test_profile_option(dag):
+    j1 = dag.defer(adder, profile='cpu')(1, 2)
+    j2 = dag.defer(adder)(3, 4)
+    assert dag.input.data["adder_0"][3] == {"profile": "cpu"}
+    assert len(dag.input.data["adder_1"]) == 3
+    j2.var(profile='cpu')
+    assert dag.input.data["adder_1"][3] == {"profile": "cpu"}
+    j2.var(profile=None)
+    assert len(dag.input.data["adder_1"]) == 3
+    out = StringIO()
+    j1.write_vars(out)
+    assert "profile" not in out.getvalue()
+    with pytest.raises(ValueError):
+        dag.defer(adder, profile='gpu')(1, 2)
+    # tracemalloc is not available to python 2 jobs
+    with pytest.raises(ValueError):
+        dag.defer(adder, profile='mem')(1, 2)
+
+def test_profile_cpu(workdir):
+    dag = htcondor_dag.Dag("test")
+    dag.defer(adder, processes=2, profile='cpu')(procid, 1)
+    dag.defer(adder, profile='cpu')(5, 6)
+    dag.defer(adder_two, profile='cpu')(1)
+    dag.defer(adder)(7, 8)
+    dag.run_local(workers=2)
+    assert htcondor_dag.load_value(open("test.adder_1.out", "rb")) == 11
+    assert htcondor_dag.profile_files(adder) == [
+        "./adder_0.0.cpu.prof", "./adder_0.1.cpu.prof", "./adder_1.0.cpu.prof"]
+    stats = htcondor_dag.merge_profiles(adder)
+    calls = [v[0] for (k, v) in stats.stats.items() if k[2] == "adder"]
+    assert calls == [3]
+    assert htcondor_dag.merge_profiles("adder_two_").total_calls >= 1
+    assert htcondor_dag.merge_profiles("missing_") is None
@@ -0,0 +1,36 @@
+import pytest
+import htcondor_dag
+
+def adder(a, b): return a + b
+def add_all(*values): return sum(values)
+
+def depth(job):
+    return 1 + max([depth(p) for p in job.parents] or [0])
+
+def test_reduce_tree(dag):
+    jobs = [dag.defer(adder)(i, 0) for i in range(100)]
+    root = dag.reduce(add_all, jobs, fan_in=8, category="reduce")
+    reducers = [n for n in dag.nodes if n.id.startswith("add_all_")]
+    # 100 -> 13 -> 2 -> 1
+    assert len(reducers) == 16
+    assert max([len(n.parents) for n in reducers]) <= 8
+    assert sorted([len(n.parents) for n in reducers[:13]]) == [7] * 4 + [8] * 9
+    assert len(root.parents) == 2
+    assert depth(root) == 4
+    assert root['category'] == "reduce"
+    assert len(root['input_files'].split(",")) == 2
+
+def test_reduce_errors(dag):
+    with pytest.raises(ValueError):
+        dag.reduce(add_all, [], fan_in=4)
+    with pytest.raises(ValueError):
+        dag.reduce(add_all, [dag.defer(adder)(1, 2)], fan_in=1)
+
+def test_reduce_run(workdir):
+    dag = htcondor_dag.Dag("test")
+    jobs = [dag.defer(adder)(i, 1) for i in range(10)]
+    single = dag.reduce(add_all, jobs[:1], fan_in=3)
+    root = dag.reduce(add_all, jobs, fan_in=3)
+    dag.run_local(workers=3)
+    assert htcondor_dag.load_value(open("test.%s.out" % root, "rb")) == 55
+    assert htcondor_dag.load_value(open("test.%s.out" % single, "rb")) == 1
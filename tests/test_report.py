@@ -0,0 +1,96 @@
+import time
+import pytest
+import htcondor_dag
+
+DAG = """\
+JOB a_0 x.sub
+VARS a_0 error="x.a_0.err" input="x.in" output="x.a_0.out"
+
+JOB b_0 x.sub
+RETRY b_0 2
+VARS b_0 error="x.b_0.err" input="x.in" output="x.b_0.out"
+
+JOB c_0 x.sub
+VARS c_0 error="x.c_0.err" input="x.in" output="x.c_0.out"
+
+JOB d_0 x.sub
+VARS d_0 error="x.d_0.err" input="x.in" output="x.d_0.out"
+PARENT a_0 CHILD b_0 c_0
+PARENT b_0 c_0 CHILD d_0
+"""
+
+def event(code, cluster, t, text, *lines):
+    (cluster, proc) = cluster if isinstance(cluster, tuple) else (cluster, 0)
+    return "%03d (%03d.%03d.000) 2024-01-31 10:%02d:%02d %s\n%s...\n" % (
+        code, cluster, proc, t // 60, t % 60, text, "".join([l + "\n" for l in lines]))
+
+def job(cluster, node, submit, execute, end, host, ret=0, proc=0):
+    cluster = (cluster, proc)
+    return [
+        (submit, event(0, cluster, submit, "Job submitted from host: <10.0.0.99:9618>",
+                       "    DAG Node: " + node)),
+        (execute, event(1, cluster, execute, "Job executing on host: <%s:9618?x=y>" % host)),
+        (end, event(5, cluster, end, "Job terminated.",
+                    "\t(1) Normal termination (return value %d)" % ret)),
+    ]
+
+def nodes_log():
+    events = (job(1, "a_0", 0, 10, 70, "10.0.0.1") +
+              job(2, "b_0", 75, 80, 100, "10.0.0.2", ret=1) +
+              job(3, "c_0", 75, 90, 110, "10.0.0.1") +
+              job(4, "b_0", 105, 120, 240, "10.0.0.2") +
+              job(5, "d_0", 245, 250, 260, "10.0.0.3"))
+    return "".join([text for (t, text) in sorted(events)])
+
+@pytest.fixture
+def run(tmpdir):
+    tmpdir.join("x.dag").write(DAG)
+    tmpdir.join("x.dag.nodes.log").write(nodes_log())
+    tmpdir.join("x.dag.dagman.out").write(
+        "01/31/24 10:01:40 Node b_0 job proc (2.0.0) failed with status 1.\n"
+        "01/31/24 10:01:40 Retrying node b_0 (retry #1 of 2)...\n")
+    tmpdir.join("x.d_0.err").write("HTCONDOR: Running on node9.example.com\n")
+    return tmpdir
+
+def test_run_report(run):
+    report = htcondor_dag.run_report(str(run.join("x.dag")))
+    start = time.mktime((2024, 1, 31, 10, 0, 0, 0, 0, -1))
+    assert report.start == start and report.end == start + 260
+    assert report.critical_path == ["a_0", "b_0", "d_0"]
+    assert report.critical_path_length == 260
+    b = report.nodes["b_0"]
+    assert (b["submits"], b["retries"], b["status"]) == (2, 1, "ok")
+    assert (b["queue_wait"], b["run_time"], b["host"]) == (15, 120, "10.0.0.2")
+    assert report.nodes["d_0"]["host"] == "node9.example.com"
+    assert report.slowest_hosts() == [("10.0.0.2", 2, 70.0, 140.0),
+                                      ("10.0.0.1", 2, 40.0, 80.0),
+                                      ("node9.example.com", 1, 10.0, 10.0)]
+    assert [r for (t, r) in report.profile] == [1, 0, 1, 2, 1, 0, 1, 0, 1, 0]
+    assert report.utilization(1) == [(start + 10, 230 / 250.0)]
+    assert [round(r, 3) for (t, r) in report.utilization(2)] == [0.92, 0.92]
+
+def test_run_report_without_extras(run):
+    run.join("x.dag.dagman.out").remove()
+    report = htcondor_dag.run_report(str(run.join("x.dag")), err_files=False)
+    assert report.nodes["b_0"]["retries"] == 1
+    assert report.nodes["d_0"]["host"] == "10.0.0.3"
+
+def test_print_report(run):
+    out = run.join("report.txt")
+    with open(str(out), "w") as f:
+        htcondor_dag.run_report(str(run.join("x.dag"))).print_report(file=f, buckets=4)
+    text = out.read()
+    assert text.startswith("4 nodes, 1 retries, 0 not ok, 260s")
+    assert "Critical path (260s)" in text
+    assert "b_0                            ok               1        15       120" in text
+
+def test_run_report_counts_every_process(tmpdir):
+    tmpdir.join("y.dag").write("JOB m_0 y.sub\n")
+    # process 0 runs longer but finishes first; both count for their hosts
+    events = (job(7, "m_0", 0, 5, 65, "10.0.0.1") +
+              job(7, "m_0", 0, 70, 90, "10.0.0.2", proc=1))
+    tmpdir.join("y.dag.nodes.log").write("".join([text for (t, text) in sorted(events)]))
+    report = htcondor_dag.run_report(str(tmpdir.join("y.dag")))
+    assert (report.nodes["m_0"]["run_time"], report.nodes["m_0"]["host"]) == (60, "10.0.0.1")
+    assert report.slowest_hosts() == [("10.0.0.1", 1, 60.0, 60.0),
+                                      ("10.0.0.2", 1, 20.0, 20.0)]
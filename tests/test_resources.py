@@ -0,0 +1,55 @@
+import os
+import pytest
+import htcondor_dag
+
+@pytest.fixture
+def fresh(monkeypatch):
+    monkeypatch.setattr(htcondor_dag, "slot", None)
+    for var in htcondor_dag.THREAD_ENV_VARS:
+        monkeypatch.delenv(var, raising=False)
+
+def test_parse_ad(tmpdir):
+    ad = tmpdir.join("ad")
+    ad.write('Name = "slot1@host"\nCpus = 8\nRequirements = (TARGET.Arch == "X86_64")\n'
+             'Quoted = "a \\"b\\""\n\nnot an attr\n')
+    assert htcondor_dag.parse_ad(str(ad)) == {
+        "Name": "slot1@host", "Cpus": 8,
+        "Requirements": '(TARGET.Arch == "X86_64")', "Quoted": 'a \\"b\\"'}
+
+def test_slot_resources_job_ad(jobad, fresh):
+    jobad.update(RequestCpus=4, RequestMemory=2048, RequestDisk="expr")
+    assert htcondor_dag.slot_resources() == {
+        "cpus": 4, "memory": 2048, "disk": None, "gpus": None}
+    assert htcondor_dag.memory_budget(0.5) == 1024 * 1024 * 1024
+
+def test_slot_resources_machine_ad(jobad, fresh, tmpdir, monkeypatch):
+    jobad.update(RequestCpus=4, RequestMemory=2048)
+    ad = tmpdir.join("machine.ad")
+    ad.write("Cpus = 8\nMemory = 4000\n")
+    monkeypatch.setenv("_CONDOR_MACHINE_AD", str(ad))
+    monkeypatch.setenv("MKL_NUM_THREADS", "2")
+    resources = htcondor_dag.tune_environment()
+    assert resources["cpus"] == 8 and resources["memory"] == 4000
+    assert os.environ["OMP_NUM_THREADS"] == "8"
+    assert os.environ["MKL_NUM_THREADS"] == "2"
+    pool = htcondor_dag.slot_executor()
+    try:
+        assert list(pool.map(abs, [-1, -2])) == [1, 2]
+    finally:
+        getattr(pool, "shutdown", getattr(pool, "close", None))()
+
+def test_slot_resources_local(fresh):
+    import multiprocessing
+    resources = htcondor_dag.slot_resources()
+    assert resources["cpus"] == multiprocessing.cpu_count()
+    assert htcondor_dag.memory_budget() is None
+
+def threads():
+    return os.environ.get("OMP_NUM_THREADS")
+
+def test_run_tune(dag, tmpdir, monkeypatch, fresh):
+    monkeypatch.chdir(tmpdir)
+    dag.defer(threads)()
+    dag.run_local(workers=1, tune=True)
+    assert htcondor_dag.load_value(open("test.threads_0.out", "rb")) == \
+        str(htcondor_dag.slot_resources()["cpus"])
@@ -0,0 +1,73 @@
+import os
+import pytest
+import htcondor_dag
+
+def adder(a, b): return a + b
+
+def build(**opts):
+    dag = htcondor_dag.Dag("test", **opts)
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(adder)(j1, 3)
+    j3 = dag.defer(adder)(j2, 4)
+    j4 = dag.defer(adder)(5, 6)
+    return (dag, [j1, j2, j3, j4])
+
+STATUS = """[
+  Type = "DagStatus";
+  DagFiles = { "test.dag" };
+]
+[
+  Type = "NodeStatus";
+  Node = "adder_0";
+  NodeStatus = 5; /* "STATUS_DONE" */
+]
+[
+  Type = "NodeStatus";
+  Node = "adder_1";
+  NodeStatus = 6; /* "STATUS_ERROR" */
+]
+[
+  Type = "NodeStatus";
+  Node = "adder_3";
+  NodeStatus = 5; /* "STATUS_DONE" */
+]
+"""
+
+def test_completed_nodes(workdir):
+    workdir.join("test.dag.rescue001").write("DONE adder_0\n")
+    workdir.join("test.dag.rescue002").write(
+        "# Rescue DAG file\nDONE adder_0\nDONE adder_2\n")
+    workdir.join("test.status").write(STATUS)
+    workdir.join("old.dag.rescue001").write("JOB a a.sub DONE\nJOB b b.sub\n")
+    assert htcondor_dag.completed_nodes("test.dag.rescue001") == set(["adder_0"])
+    assert htcondor_dag.completed_nodes("test.dag") == set(["adder_0", "adder_2"])
+    assert htcondor_dag.completed_nodes("test.status") == set(["adder_0", "adder_3"])
+    assert htcondor_dag.completed_nodes("old.dag") == set(["a"])
+    assert htcondor_dag.completed_nodes("missing.dag") == set()
+    assert htcondor_dag.completed_nodes(None) == set()
+    assert htcondor_dag.completed_nodes(["test.status", "test.dag.rescue001"]) == \
+        set(["adder_0", "adder_3"])
+
+def test_resume_rescue(workdir):
+    workdir.join("test.dag.rescue001").write("DONE adder_0\nDONE adder_2\nDONE adder_3\n")
+    (dag, jobs) = build()
+    dag.write(resume_from="test.dag")
+    # adder_2 has a parent which is not done, so it is rerun
+    assert [j.done for j in jobs] == [True, False, False, True]
+    text = open("test.dag").read()
+    assert "JOB adder_0 test.sub DONE" in text
+    assert "JOB adder_2 test.sub\n" in text
+    assert not os.path.exists("test.in")
+    assert os.path.exists("test.adder_1.in") and os.path.exists("test.adder_2.in")
+
+def test_resume_stream(workdir):
+    workdir.join("test.status").write(STATUS)
+    (dag, jobs) = build(stream=True, resume_from="test.status")
+    dag.write()
+    assert "JOB adder_3 test.sub DONE" in open("test.dag").read()
+    assert not os.path.exists("test.in")
+    assert os.path.exists("test.adder_1.in") and os.path.exists("test.adder_2.in")
+
+    (dag, jobs) = build(stream=True)
+    with pytest.raises(ValueError):
+        dag.write(resume_from="test.status")
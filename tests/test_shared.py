@@ -0,0 +1,60 @@
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import StringIO
+import htcondor_dag
+
+def lookup(table, key): return table[key]
+
+def test_share_large_args(mockfs, jobad):
+    dag = htcondor_dag.Dag("test", share_bytes=1000)
+    table = dict((i, i*i) for i in range(1000))
+    small = {"a": 1}
+    j0 = dag.defer(lookup)(table, 10)
+    j1 = dag.defer(lookup, input=None)(table, key=20)
+    j2 = dag.defer(lookup)(small, "a")
+    dag.write()
+
+    assert len(dag.shared) == 1
+    shared = dag.shared.values()[0]
+    assert shared.filename.startswith("test.") and shared.filename.endswith(".shared")
+    assert j0['input_files'] == shared.filename
+    assert j1['input_files'] == shared.filename
+    assert 'input_files' not in j2.vars
+    assert len(mockfs["test.in"]) < 1000
+    assert len(mockfs["test.lookup_1.in"]) < 1000
+
+    # The value is read only once at runtime
+    htcondor_dag.shared_values.clear()
+    jobad['DAGNodeName'] = 'lookup_0'
+    dst = StringIO.StringIO()
+    htcondor_dag.run(src=open("test.in", "rb"), dst=dst)
+    assert pickle.loads(dst.getvalue()) == 100
+    del mockfs.files[shared.filename]
+    jobad['DAGNodeName'] = 'lookup_1'
+    dst = StringIO.StringIO()
+    htcondor_dag.run(src=open("test.lookup_1.in", "rb"), dst=dst)
+    assert pickle.loads(dst.getvalue()) == 400
+    htcondor_dag.shared_values.clear()
+
+def test_share_equal_values(dag, mockfs):
+    dag = htcondor_dag.Dag("test", share_bytes=100)
+    dag.defer(lookup)(range(100), 1)
+    dag.defer(lookup)(range(100), 2)
+    assert len(dag.shared) == 1
+
+def test_share_remembers_recent_values(mockfs):
+    dag = htcondor_dag.Dag("test", share_bytes=100)
+    tables = [range(i, i + 100) for i in range(htcondor_dag.SHARE_RECENT + 5)]
+    for table in tables:
+        assert dag.share(table) is dag.share(table)
+    assert len(dag.shared_ids) == htcondor_dag.SHARE_RECENT
+    assert dag.shared_ids.values()[-1][0] is tables[-1]
+    # Arguments are captured when the call is deferred
+    table = range(100)
+    dag.defer(lookup)(table, 1)
+    table.append(100)
+    dag.write()
+    shared = dag.share(range(100))
+    assert pickle.loads(mockfs[shared.filename]) == range(100)
@@ -0,0 +1,42 @@
+import htcondor_dag
+
+def a(): pass
+def b(x): pass
+def c(*x): pass
+
+def test_simulate_diamond(dag):
+    ja = dag.defer(a)()
+    jb1 = dag.defer(b)(ja)
+    jb2 = dag.defer(b, processes=3)(ja)
+    jc = dag.defer(c)(jb1, jb2)
+
+    sim = dag.simulate({"a": 1, "b": 5, "c": 2})
+    assert sim.makespan == 8
+    assert sim.critical_path_length == 8
+    assert [j.id for j in sim.critical_path][0] == "a_0"
+    assert [j.id for j in sim.critical_path][2] == "c_0"
+    assert max(r for (t, r) in sim.profile) == 4
+    assert sim.schedule["c_0"] == [6, 8]
+
+    # With two slots the cluster has to queue
+    sim = dag.simulate({"a": 1, "b": 5, "c": 2}, slots=2)
+    assert sim.makespan == 13
+    assert sim.slot_wait == 10
+    assert max(r for (t, r) in sim.profile) == 2
+    assert sim.critical_path_length == 8
+
+def test_simulate_maxjobs(dag):
+    dag.maxjobs["slow"] = 2
+    for i in range(6):
+        dag.defer(a, category="slow")()
+    dag.defer(b)(1)
+
+    sim = dag.simulate(lambda job: 10 if job.func is a else 1)
+    assert sim.makespan == 30
+    assert sim.category_wait == {"slow": 10 + 10 + 20 + 20}
+    assert sim.bottlenecks() == [("slow", 60)]
+
+def test_simulate_empty(dag):
+    sim = dag.simulate()
+    assert sim.makespan == 0
+    assert sim.critical_path == []
@@ -0,0 +1,54 @@
+import os
+import json
+import pytest
+import htcondor_dag
+from htcondor_dag import procid
+from StringIO import StringIO
+
+def adder(a, b): return a + b
+def total(values): return sum(values)
+def fail(): raise ValueError("always")
+
+def test_stats(workdir):
+    dag = htcondor_dag.Dag("test", share_bytes=100)
+    j1 = dag.defer(adder, processes=2)(procid, 10)
+    j2 = dag.defer(total)(j1)
+    j3 = dag.defer(adder)(range(50), [1])
+    dag.run_local(workers=2, stats="stats")
+
+    names = sorted(os.listdir("stats"))
+    assert names == ["adder_0.0.stats.json", "adder_0.1.stats.json",
+                     "adder_1.0.stats.json", "total_0.0.stats.json"]
+    with open("stats/total_0.0.stats.json") as f:
+        r = json.load(f)
+    assert r["node"] == "total_0"
+    assert r["procid"] == 0
+    assert r["host"]
+    assert r["bytes_read"] > 0
+    assert r["bytes_written"] == len(open("test.total_0.out", "rb").read())
+    assert set(r["seconds"]) == set(["input", "outputs", "call", "write", "total"])
+    with open("stats/adder_1.0.stats.json") as f:
+        assert "shared" in json.load(f)["seconds"]
+
+    rows = htcondor_dag.collect_stats("stats")
+    assert len(rows) == 4
+    assert rows[0]["seconds"]["total"] >= rows[-1]["seconds"]["total"]
+    out = StringIO()
+    htcondor_dag.print_stats(rows, file=out)
+    assert "total_0.0" in out.getvalue()
+    assert r["host"] in out.getvalue()
+
+def test_stats_error(workdir):
+    dag = htcondor_dag.Dag("test")
+    dag.defer(fail)()
+    with pytest.raises(RuntimeError):
+        dag.run_local(workers=1, stats=True)
+    with open("fail_0.0.stats.json") as f:
+        assert json.load(f)["error"] == "ValueError: always"
+    assert htcondor_dag.job_stats is None
+
+def test_stats_unicode_directory(workdir):
+    dag = htcondor_dag.Dag("test")
+    dag.defer(adder)(1, 2)
+    dag.run_local(workers=1, stats=u"stats")
+    assert os.listdir("stats") == ["adder_0.0.stats.json"]
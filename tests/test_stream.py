@@ -0,0 +1,60 @@
+import pytest
+import htcondor_dag
+
+def adder(a,b): return a+b
+
+def test_stream(mockfs):
+    dag = htcondor_dag.Dag("test", stream=True)
+    d_adder = dag.defer(adder)
+    j1 = d_adder(1, 2)
+    assert "test.dag" not in mockfs.files
+    j2 = d_adder(3, 4)
+    # adder_0 has been written out and dropped
+    assert dag.nodes == [j2]
+    assert mockfs["test.dag"].getvalue() == """
+JOB adder_0 test.sub
+VARS adder_0 error="test.adder_0.err" input="test.in" output="test.adder_0.out"
+"""
+    with pytest.raises(ValueError):
+        j1.var(request_memory=100)
+    with pytest.raises(ValueError):
+        dag.dependencies()
+
+    j3 = d_adder(j1, j2)
+    j4 = dag.defer(adder, input=None)(5, 6)
+    j1.child(j4)
+    j4.parent(j2)
+    dag.write()
+
+    assert mockfs["test.dag"] == """
+JOB adder_0 test.sub
+VARS adder_0 error="test.adder_0.err" input="test.in" output="test.adder_0.out"
+
+JOB adder_1 test.sub
+VARS adder_1 error="test.adder_1.err" input="test.in" output="test.adder_1.out"
+
+JOB adder_2 test.sub
+VARS adder_2 error="test.adder_2.err" input="test.adder_2.in" input_files="test.adder_0.out,test.adder_1.out" output="test.adder_2.out"
+
+JOB adder_3 test.sub
+VARS adder_3 error="test.adder_3.err" input="test.adder_3.in" output="test.adder_3.out"
+PARENT adder_0 adder_1 CHILD adder_2 adder_3
+"""
+    assert htcondor_dag.read_input(open("test.in", "rb")) == {
+        "adder_0": (adder, (1,2), {}),
+        "adder_1": (adder, (3,4), {}),
+    }
+    assert htcondor_dag.read_input(open("test.adder_3.in", "rb")) == {
+        "adder_3": (adder, (5,6), {}),
+    }
+    assert "test.sub" in mockfs.files
+
+def test_stream_shards(mockfs):
+    dag = htcondor_dag.Dag("test", stream=True, shard_jobs=2)
+    for i in range(5):
+        dag.defer(adder)(i, i)
+    dag.write()
+    assert sorted(htcondor_dag.read_input(open("test.1.in", "rb")).keys()) == \
+        ["adder_2", "adder_3"]
+    assert htcondor_dag.read_input(open("test.2.in", "rb"), "adder_4") == \
+        (adder, (4,4), {})
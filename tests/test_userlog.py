@@ -0,0 +1,138 @@
+import time
+import pytest
+import htcondor_dag
+
+NODES_LOG = """\
+000 (101.000.000) 2024-01-31 10:00:00 Job submitted from host: <10.0.0.1:9618?addrs=10.0.0.1-9618>
+    DAG Node: adder_0
+...
+000 (102.000.000) 2024-01-31 10:00:01 Job submitted from host: <10.0.0.1:9618?addrs=10.0.0.1-9618>
+    DAG Node: adder_1
+...
+040 (101.000.000) 2024-01-31 10:00:10 Started transferring input files
+\tTransferring to host: <10.0.0.5:9618?addrs=10.0.0.5-9618>
+...
+040 (101.000.000) 2024-01-31 10:00:12 Finished transferring input files
+...
+001 (101.000.000) 2024-01-31 10:00:12 Job executing on host: <10.0.0.5:9618?addrs=10.0.0.5-9618>
+\tSlotName: slot1_1@node5.example.com
+...
+001 (102.000.000) 2024-01-31 10:00:20 Job executing on host: <10.0.0.6:9618?addrs=10.0.0.6-9618>
+...
+006 (101.000.000) 2024-01-31 10:00:20 Image size of job updated: 150000
+\t100  -  MemoryUsage of job (MB)
+\t102400  -  ResidentSetSize of job (KB)
+...
+006 (102.000.000) 2024-01-31 10:00:30 Image size of job updated: 350000
+\t300  -  MemoryUsage of job (MB)
+\t307200  -  ResidentSetSize of job (KB)
+...
+012 (102.000.000) 2024-01-31 10:00:31 Job was held.
+\tJob has gone over memory limit of 256 megabytes.
+\tCode 34 Subcode 0
+...
+013 (102.000.000) 2024-01-31 10:01:00 Job was released.
+\tvia condor_release (by user me)
+...
+005 (101.000.000) 2024-01-31 10:01:12 Job terminated.
+\t(1) Normal termination (return value 0)
+\t\tUsr 0 00:00:50, Sys 0 00:00:04  -  Run Remote Usage
+\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage
+\t\tUsr 0 00:00:50, Sys 0 00:00:04  -  Total Remote Usage
+\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Total Local Usage
+\t0  -  Run Bytes Sent By Job
+\t1000  -  Run Bytes Received By Job
+\t0  -  Total Bytes Sent By Job
+\t1000  -  Total Bytes Received By Job
+\tPartitionable Resources :    Usage  Request Allocated
+\t   Cpus                 :     0.90        1         1
+\t   Disk (KB)            :       25     1000      2000
+\t   Memory (MB)          :      120     1024      1024
+...
+000 (103.000.000) 01/31 10:01:30 Job submitted from host: <10.0.0.1:9618?addrs=10.0.0.1-9618>
+    DAG Node: combine_0
+...
+001 (102.000.000) 2024-01-31 10:02:00 Job executing on host: <10.0.0.7:9618?addrs=10.0.0.7-9618>
+...
+005 (102.000.000) 2024-01-31 10:03:00 Job terminated.
+\t(1) Normal termination (return value 1)
+\t\tUsr 0 00:00:30, Sys 0 00:00:00  -  Run Remote Usage
+\tPartitionable Resources :    Usage  Request Allocated
+\t   Cpus                 :     1.20        1         1
+\t   Disk (KB)            :       30     1000      2000
+\t   Memory (MB)          :      280      256       256
+...
+"""
+
+@pytest.fixture
+def nodes_log(tmpdir):
+    log = tmpdir.join("test.dag.nodes.log")
+    log.write(NODES_LOG)
+    return str(log)
+
+def at(hh, mm, ss):
+    return time.mktime((2024, 1, 31, hh, mm, ss, 0, 0, -1))
+
+def test_read_user_log(nodes_log):
+    events = list(htcondor_dag.read_user_log(nodes_log))
+    assert [e["code"] for e in events] == [0, 0, 40, 40, 1, 1, 6, 6, 12, 13, 5, 0, 1, 5]
+    assert events[0]["node"] == "adder_0"
+    assert events[0]["time"] == at(10, 0, 0)
+    assert events[4]["host"] == "node5.example.com"
+    assert events[5]["host"] == "10.0.0.6"
+    assert events[6]["values"]["MemoryUsage of job (MB)"] == 100
+    term = events[10]
+    assert term["return_value"] == 0
+    assert term["usage"]["Run Remote Usage"] == 54
+    assert term["resources"]["Memory"] == (120, 1024, 1024)
+    assert term["values"]["Run Bytes Received By Job"] == 1000
+    assert events[11]["cluster"] == 103 and events[11]["node"] == "combine_0"
+
+def test_job_runs(nodes_log):
+    runs = dict([(r["node"], r) for r in htcondor_dag.job_runs(nodes_log)])
+    a0 = runs["adder_0"]
+    assert a0["status"] == "ok"
+    assert a0["queue_wait"] == 12 and a0["run_time"] == 60
+    assert a0["transfer_in"] == 2 and a0["transfer_out"] is None
+    assert a0["memory"] == 120 and a0["cpus"] == 0.9 and a0["cpu_seconds"] == 54
+    assert a0["requests"] == {"memory": 1024, "cpus": 1, "disk": 1000}
+    a1 = runs["adder_1"]
+    assert a1["status"] == "failed"
+    assert a1["held"] == 1 and a1["host"] == "10.0.0.7"
+    assert a1["started"] == at(10, 0, 20) and a1["run_time"] == 60
+    assert a1["memory"] == 300
+    assert runs["combine_0"]["status"] == "incomplete"
+
+def test_recommend_resources(nodes_log):
+    usage = htcondor_dag.function_usage(htcondor_dag.job_runs(nodes_log), 95)
+    assert usage["adder"]["memory"] == (300, 2)
+    assert usage["adder"]["run_time"] == (60, 2)
+    assert usage["adder"]["requests"] == {"memory": 256, "cpus": 1, "disk": 1000}
+    assert "run_time" not in usage["combine"]
+    hints = htcondor_dag.recommend_resources(usage, headroom=0.2)
+    assert hints == {"adder": {"request_memory": 360, "request_cpus": 1,
+                               "request_disk": 36}}
+    assert htcondor_dag.nearest_rank([5, 1, 3, 2, 4], 50) == 3
+    assert htcondor_dag.nearest_rank([5, 1, 3, 2, 4], 100) == 5
+    assert htcondor_dag.node_function("adder_12") == "adder"
+
+def adder(a, b): return a + b
+def other(a): return a
+
+def test_tune_resources(dag, nodes_log):
+    dag.tune_resources(nodes_log)
+    assert dag.run_times == {"adder": 60}
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(adder, request_memory=50)(1, 2)
+    j3 = dag.defer(other)(1)
+    assert j1["request_memory"] == 360 and j1["request_cpus"] == 1
+    assert j2["request_memory"] == 50
+    assert "request_memory" not in j3.vars
+    assert dag.tuning_report() == [
+        "adder: request_memory 256 -> 360 MB on 1 jobs (used 300 MB in 2 earlier jobs)",
+        "adder: request_disk 1000 -> 36 KB on 2 jobs (used 30 KB in 2 earlier jobs)"]
+
+def test_tuning_report_overridden(dag, nodes_log):
+    dag.tune_resources(nodes_log)
+    dag.defer(adder, request_memory=50, request_disk=10)(1, 2)
+    assert dag.tuning_report() == []
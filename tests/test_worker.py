@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import textwrap
+import htcondor_dag
+
+SCRIPT = textwrap.dedent("""\
+    import sys, os, posixpath
+    sys.path.insert(0, %r)
+    from htcondor_dag import Dag, autorun
+    open("loaded", "a").write("x")
+
+    def adder(a, b):
+        return a + b
+
+    autorun(compression="zlib", report_hostname=False)
+    open("generated", "w").close()
+    dag = Dag("test", worker=True)
+    j1 = dag.defer(adder)(1, 2)
+    j2 = dag.defer(posixpath.join)("a", "b")
+    dag.defer(adder)(j1, 10)
+    dag.write()
+    """)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_job(node, input, *args):
+    with open("job.ad", "w") as f:
+        f.write('DAGNodeName = "%s"\nProcId = 0\n' % node)
+    env = dict(os.environ, _CONDOR_JOB_AD="job.ad")
+    with open(input, "rb") as src:
+        with open("test.%s.out" % node, "wb") as dst:
+            proc = subprocess.Popen(
+                [sys.executable, os.path.join(REPO, "htcondor_dag.py")] + list(args),
+                stdin=src, stdout=dst, stderr=subprocess.PIPE, env=env)
+            err = proc.communicate()[1]
+    assert proc.returncode == 0, err
+    return err.decode("utf-8")
+
+def test_worker(workdir):
+    workdir.join("gen.py").write(SCRIPT % REPO)
+    subprocess.check_call([sys.executable, "gen.py"])
+    sub = open("test.sub").read()
+    assert "executable = %s\n" % os.path.join(REPO, "htcondor_dag.py") in sub
+    assert "arguments = \"'gen.py' '--compression=zlib' '--quiet'\"" in sub
+    assert "gen.py,$(input_files)" in sub
+    os.unlink("loaded")
+    os.unlink("generated")
+
+    # A function from another module does not need the script
+    run_job("join_0", "test.in", "gen.py", "--quiet")
+    assert htcondor_dag.load_value(open("test.join_0.out", "rb")) == "a/b"
+    assert not os.path.exists("loaded")
+
+    # The script is run up to autorun() for its own functions
+    err = run_job("adder_0", "test.in", "gen.py", "--compression=zlib", "--stats")
+    assert "worker startup" in err
+    assert open("loaded").read() == "x"
+    assert not os.path.exists("generated")
+    data = open("test.adder_0.out", "rb").read()
+    assert htcondor_dag.codec_of(data) == "zlib"
+    assert htcondor_dag.load_value(open("test.adder_0.out", "rb")) == 3
+    stats = htcondor_dag.collect_stats()
+    assert stats[0]["seconds"]["startup"] > 0
+
+    run_job("adder_1", "test.adder_1.in", "gen.py", "--quiet")
+    assert htcondor_dag.load_value(open("test.adder_1.out", "rb")) == 13
@@ -1,7 +1,4 @@
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import htcondor_dag
 
 def foo(a): pass
 
@@ -69,7 +66,7 @@ RETRY foo_1 2
 VARS foo_1 error="test.foo_1.err" input="test.in" output="test.foo_1.out" request_memory="123"
 """
 
-    args = pickle.loads(mockfs["test.in"])
+    args = htcondor_dag.read_input(open("test.in", "rb"))
     assert args == {
         "foo_0": (foo, (100,), {}),
         "foo_1": (foo, (), {"a":200}),
@@ -132,3 +129,59 @@ VARS foo_0 error="test.foo_0.err" input="test.in" output="test.foo_0.out"
 
     assert mockfs["test.config"] == """DAGMAN_MUNGE_NODE_NAMES = False
 """
+
+def test_write_grouped_edges(dag, mockfs):
+    a = [dag.job("a%d" % i, "a.sub") for i in range(3)]
+    b = [dag.job("b%d" % i, "b.sub").parent(*a) for i in range(2)]
+    c = dag.job("c", "c.sub").parent(b[0])
+    b[1].child(c)
+    d = dag.job("d", "d.sub")
+    a[0].child(d)
+    d.parent(a[0])
+    dag.write()
+
+    assert mockfs["test.dag"].endswith("""
+JOB d d.sub
+PARENT a0 a1 a2 CHILD b0 b1
+PARENT b0 b1 CHILD c
+PARENT a0 CHILD d
+""")
+
+def test_duplicate_edges(dag):
+    a = dag.job("a")
+    b = [dag.job("b%d" % i).parent(a) for i in range(3)]
+    a.child(b[1])
+    b[2].parent(a)
+    c = dag.job("c").parent(*b)
+    c.parent(b[0], b[0])
+    assert list(dag.child_lists[a.index]) == [1, 2, 3]
+    assert list(dag.parent_lists[c.index]) == [1, 2, 3]
+    assert [n.id for n in dag.related(dag.parent_lists[b[1].index])] == ["a"]
+
+def test_write_reduce_edges(dag, mockfs):
+    # a -> b -> c, plus redundant a -> c and a -> d, c -> d
+    a = dag.defer(foo)(1)
+    b = dag.defer(foo)(a)
+    c = dag.defer(foo)(b).parent(a)
+    d = dag.job("d", "d.sub").parent(a, b, c)
+    e = dag.job("e", "e.sub").parent(a)
+    dag.write(reduce_edges=True)
+
+    assert dag.removed_edges == 3
+    assert mockfs["test.dag"].endswith("""
+JOB e e.sub
+PARENT foo_0 CHILD e foo_1
+PARENT foo_1 CHILD foo_2
+PARENT foo_2 CHILD d
+""")
+    # Data-flow still declares all the files needed
+    assert c['input_files'] == "test.foo_1.out"
+    assert a.children == set([b, c, d, e])
+
+def test_write_reduce_edges_diamond(dag, mockfs):
+    a = dag.job("a", "a.sub")
+    b = dag.job("b", "b.sub").parent(a)
+    c = dag.job("c", "c.sub").parent(a)
+    d = dag.job("d", "d.sub").parent(b, c)
+    dag.write(reduce_edges=True)
+    assert dag.removed_edges == 0